@@ -0,0 +1,79 @@
+import sys, json, cache
+import numpy as np
+import mdp, p3
+
+# Parameters that may differ between the problems of a batch
+PARAMS = ['discount', 'noise', 'livingReward']
+
+def value_iteration_batch(grid, params, iterations, tolerance=None, layout=None):
+    """Value iteration of one grid under many parameter sets at once.
+
+    params is a list of dicts with the PARAMS of every problem. The grid is
+    compiled once and V carries a leading batch axis, so every sweep backs
+    up all the problems together; the values of each problem are the same
+    as those of p3.value_iteration with the table engine. With a tolerance,
+    a problem stops being updated once its residual falls below it and the
+    others carry on. Returns the model of the grid and V, best (indices into
+    p3.ACTIONS), iterations (the last k) and residual, batch axis first.
+    """
+    model = mdp.compile_model(grid, 0.0, 0.0, layout)
+    terminal = model['terminal']
+    terminal_rewards = model['terminal_rewards'][terminal]
+    # Columns in the order of p3.ACTIONS, so argmax gives indices into it
+    next_states = model['next_states'][:, p3.ACTION_CODES]
+    num_states = len(model['cells'])
+
+    # One row of parameters per problem, shaped to broadcast against Q
+    # (see mdp.q_values, probs has the outcomes on its last axis)
+    noise = np.array([p['noise'] for p in params], dtype=float)
+    probs = np.stack([1 - 2 * noise, noise, noise], axis=1)[:, np.newaxis, np.newaxis, :]
+    livingReward = np.array([p['livingReward'] for p in params], dtype=float)[:, np.newaxis, np.newaxis]
+    discount = np.array([p['discount'] for p in params], dtype=float)[:, np.newaxis, np.newaxis]
+
+    V = np.zeros((len(params), num_states))
+    best = np.zeros((len(params), num_states), dtype=int)
+    last = np.zeros(len(params), dtype=int)
+    residual = np.full(len(params), np.inf)
+    active = np.ones(len(params), dtype=bool)
+    for k in range(1, iterations):
+        rows = np.nonzero(active)[0]
+        V_active = V[rows]
+        batch_model = {'probs': probs[rows], 'livingReward': livingReward[rows]}
+        Q = mdp.q_values(batch_model, V_active, discount[rows], next_states)
+        best_active = np.argmax(Q, axis=2)
+        V_new = np.take_along_axis(Q, best_active[:, :, np.newaxis], axis=2)[:, :, 0]
+        V_new[:, terminal] = terminal_rewards
+
+        residual[rows] = np.max(np.abs(V_new - V_active), axis=1) if num_states else 0.0
+        V[rows], best[rows], last[rows] = V_new, best_active, k
+        if tolerance is not None:
+            active[rows] = residual[rows] >= tolerance
+            if not active.any():
+                break
+
+    return {
+        'model': model,
+        'V': V,
+        'best': best,
+        'iterations': last,
+        'residual': residual,
+    }
+
+def format_batch(params, result):
+    # The values and policy of the last sweep of every problem, as p3 prints them
+    model = result['model']
+    blocks = []
+    for b, p in enumerate(params):
+        k = result['iterations'][b]
+        blocks.append(', '.join('{}: {}'.format(key, p[key]) for key in PARAMS))
+        blocks.append(f"V_k={k}\n" + p3.format_values(result['V'][b], model))
+        blocks.append(f"pi_k={k}\n" + p3.format_policy(p3.greedy_policy(model, result['best'][b]), model))
+    return '\n'.join(blocks)
+
+if __name__ == "__main__":
+    # python batch.py <problem file> <json list of parameter sets> [tolerance]
+    problem = cache.load_problem(sys.argv[1])
+    params = [dict({key: problem[key] for key in PARAMS}, **p) for p in json.loads(sys.argv[2])]
+    tolerance = float(sys.argv[3]) if len(sys.argv) > 3 else None
+    result = value_iteration_batch(problem['grid'], params, problem['iterations'], tolerance, problem.get('layout'))
+    print(format_batch(params, result))
@@ -0,0 +1,228 @@
+"""
+Benchmarks for the grid MDP solvers on generated grids.
+
+Generates parameterised grids (size, wall density, number and placement of
+terminals, noise, discount) and times p1.play_episode, p2.policy_evaluation,
+p3.value_iteration (all three engines) and the p4 Q-learner on them. Every
+benchmark runs in a fresh process so its peak memory (max RSS) can be
+measured; results are appended as one JSON object per line to a results
+file, tagged with the git revision, so revisions can be compared.
+
+How to Run:
+- python bench.py run [--sizes 10 100 1000] [--output bench_results.jsonl]
+- python bench.py compare old.jsonl new.jsonl
+"""
+
+import argparse, itertools, json, random, resource, subprocess, time
+from concurrent.futures import ProcessPoolExecutor
+import mdp, parse, p1, p2, p3, p4
+
+BENCHMARKS = ['play_episode', 'policy_evaluation', 'value_iteration', 'value_iteration_grid',
+              'value_iteration_parallel', 'q_learning']
+# Config keys describing the generated problem; the others (max_steps,
+# learners, episodes, workers) size the p1, p4 and parallel benchmarks
+PROBLEM_KEYS = ['size', 'wall_density', 'num_terminals', 'placement', 'noise', 'discount',
+                'livingReward', 'iterations', 'seed']
+
+def generate_grid(rows, cols, wall_density=0.1, num_terminals=2, placement='random', seed=None):
+    """Random grid of '_' cells with walls, one start 'S' and terminals.
+
+    Terminals alternate between rewards 1 and -1 and are placed at random
+    cells, on the border ('border') or in the corners first ('corners').
+    """
+    rng = random.Random(seed)
+    grid = [['#' if rng.random() < wall_density else '_' for _ in range(cols)] for _ in range(rows)]
+    cells = [(i, j) for i in range(rows) for j in range(cols)]
+    if placement == 'border':
+        candidates = [(i, j) for i, j in cells if i in (0, rows - 1) or j in (0, cols - 1)]
+    elif placement == 'corners':
+        corners = [(0, 0), (0, cols - 1), (rows - 1, 0), (rows - 1, cols - 1)]
+        candidates = corners + [cell for cell in cells if cell not in corners]
+    elif placement == 'random':
+        candidates = cells
+    else:
+        raise ValueError("Unknown placement: {}".format(placement))
+    if placement != 'corners':
+        rng.shuffle(candidates)
+    chosen = candidates[:num_terminals + 1]
+    start = chosen[-1]
+    for k, (i, j) in enumerate(chosen[:-1]):
+        grid[i][j] = '1' if k % 2 == 0 else '-1'
+    grid[start[0]][start[1]] = 'S'
+    return grid
+
+def generate_problem(size, wall_density=0.1, num_terminals=2, placement='random',
+                     noise=0.1, discount=0.9, livingReward=-0.01, iterations=20, seed=0):
+    """Problem dict with a generated grid and a random policy ('exit' on terminals)."""
+    rows, cols = size if isinstance(size, tuple) else (size, size)
+    grid = generate_grid(rows, cols, wall_density, num_terminals, placement, seed)
+    rng = random.Random(seed)
+    policy = []
+    for row in grid:
+        policy_row = []
+        for cell in row:
+            if cell == '#':
+                policy_row.append('#')
+            elif mdp.terminal_reward(cell) is not None:
+                policy_row.append('exit')
+            else:
+                policy_row.append(rng.choice(mdp.DIRECTIONS))
+        policy.append(policy_row)
+    return {
+        'seed': seed,
+        'discount': discount,
+        'noise': noise,
+        'livingReward': livingReward,
+        'iterations': iterations,
+        'grid': grid,
+        'policy': policy,
+    }
+
+def write_problem(problem, file_path):
+    # Write a problem in the .prob format read by parse
+    with open(file_path, 'w') as f:
+        for key in parse.KEYS:
+            if key in problem:
+                f.write('{}: {}\n'.format(key, problem[key]))
+        for key in parse.SECTIONS:
+            f.write(key + ':\n')
+            for row in problem[key]:
+                f.write(' '.join('{:>5}'.format(token) for token in row) + '\n')
+
+def run_benchmark(name, config):
+    """Time one benchmark on one generated problem, in the current process.
+
+    Returns the wall time, the amount of work done (environment steps or
+    state backups), the throughput and the peak RSS of the process.
+    """
+    problem = generate_problem(**{key: config[key] for key in PROBLEM_KEYS if key in config})
+    start = time.perf_counter()
+    if name == 'play_episode':
+        # Traces re-render the whole grid every step, so cap the steps
+        problem['seed'] = config.get('seed', 0)
+        lines = itertools.islice(p1.episode_lines(problem), 6 * config.get('max_steps', 100))
+        work = sum(1 for line in lines if line.startswith('Taking action'))
+        unit = 'steps'
+    elif name == 'policy_evaluation':
+        model = mdp.compile_model(problem['grid'], problem['noise'], problem['livingReward'])
+        codes = mdp.compile_policy(model, problem['policy'])
+        for k, V, residual in p2.policy_evaluation_sweeps(model, problem['discount'], codes, problem['iterations']):
+            pass
+        work = k * len(model['cells'])
+        unit = 'backups'
+    elif name in ['value_iteration', 'value_iteration_grid', 'value_iteration_parallel']:
+        engine = {'value_iteration': 'table', 'value_iteration_grid': 'grid',
+                  'value_iteration_parallel': 'parallel'}[name]
+        model = mdp.compile_model(problem['grid'], problem['noise'], problem['livingReward'])
+        for k, V, best, residual, backups in p3.value_iteration_sweeps(
+                model, problem['discount'], problem['iterations'], engine, workers=config.get('workers')):
+            pass
+        work = backups
+        unit = 'backups'
+    elif name == 'q_learning':
+        result = p4.q_learning_population(config.get('learners', 8), seed=config.get('seed', 0),
+                                          max_episodes=config.get('episodes', 20),
+                                          max_steps_per_episode=config.get('max_steps', 100),
+                                          grid=problem['grid'])
+        work = int(result['steps'].sum())
+        unit = 'steps'
+    else:
+        raise ValueError("Unknown benchmark: {}".format(name))
+    elapsed = time.perf_counter() - start
+    return {
+        'benchmark': name,
+        'config': config,
+        'time': elapsed,
+        'work': work,
+        'unit': unit,
+        'throughput': work / elapsed if elapsed > 0 else float('inf'),
+        # ru_maxrss is in KiB on Linux
+        'peak_rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+    }
+
+def run_suite(benchmarks, sizes, base_config=None, output=None):
+    revision = git_revision()
+    results = []
+    # One fresh worker process per benchmark, so max RSS is its own
+    with ProcessPoolExecutor(max_workers=1, max_tasks_per_child=1) as pool:
+        for size in sizes:
+            for name in benchmarks:
+                config = dict(base_config or {}, size=size)
+                result = pool.submit(run_benchmark, name, config).result()
+                result['revision'] = revision
+                results.append(result)
+                print('{:<24} {:>6}  {:>9.3f}s  {:>14,.0f} {}/s  {:>8.1f} MiB'.format(
+                    name, size, result['time'], result['throughput'], result['unit'],
+                    result['peak_rss'] / 2**20))
+                if output is not None:
+                    with open(output, 'a') as f:
+                        f.write(json.dumps(result) + '\n')
+    return results
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def load_results(file_path):
+    with open(file_path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def compare(old_path, new_path):
+    # Throughput ratio new / old of every benchmark and size present in both
+    def key(result):
+        return result['benchmark'], json.dumps(result['config'], sort_keys=True)
+    old = {key(result): result for result in load_results(old_path)}
+    lines = []
+    for result in load_results(new_path):
+        if key(result) in old:
+            before = old[key(result)]
+            lines.append('{:<24} {:>6}  {:>14,.0f} -> {:>14,.0f} {}/s  x{:.2f}'.format(
+                result['benchmark'], str(result['config']['size']), before['throughput'],
+                result['throughput'], result['unit'], result['throughput'] / before['throughput']))
+    return '\n'.join(lines)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the solvers on generated grids.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    run = subparsers.add_parser('run')
+    run.add_argument('--benchmarks', nargs='+', default=BENCHMARKS, choices=BENCHMARKS)
+    run.add_argument('--sizes', nargs='+', type=int, default=[10, 50, 100, 200])
+    run.add_argument('--wall-density', type=float, default=0.1)
+    run.add_argument('--terminals', type=int, default=2)
+    run.add_argument('--placement', default='random', choices=['random', 'border', 'corners'])
+    run.add_argument('--noise', type=float, default=0.1)
+    run.add_argument('--discount', type=float, default=0.9)
+    run.add_argument('--living-reward', type=float, default=-0.01)
+    run.add_argument('--iterations', type=int, default=20)
+    run.add_argument('--seed', type=int, default=0)
+    run.add_argument('--max-steps', type=int, default=100)
+    run.add_argument('--learners', type=int, default=8)
+    run.add_argument('--episodes', type=int, default=20)
+    run.add_argument('--workers', type=int, default=None)
+    run.add_argument('--output', default='bench_results.jsonl')
+    cmp = subparsers.add_parser('compare')
+    cmp.add_argument('old')
+    cmp.add_argument('new')
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        base_config = {
+            'wall_density': args.wall_density,
+            'num_terminals': args.terminals,
+            'placement': args.placement,
+            'noise': args.noise,
+            'discount': args.discount,
+            'livingReward': args.living_reward,
+            'iterations': args.iterations,
+            'seed': args.seed,
+            'max_steps': args.max_steps,
+            'learners': args.learners,
+            'episodes': args.episodes,
+            'workers': args.workers,
+        }
+        run_suite(args.benchmarks, args.sizes, base_config, args.output)
+    else:
+        print(compare(args.old, args.new))
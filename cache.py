@@ -0,0 +1,200 @@
+import hashlib, json, os, shutil, tempfile, time
+import numpy as np
+import mdp, parse
+
+# Bump when the layout of cache entries changes
+CACHE_VERSION = 2
+CACHE_DIR_NAME = '__mdpcache__'
+# Temporary files and entries being written; left behind by a crashed
+# writer, they are removed once older than TMP_MAX_AGE seconds
+TMP_PREFIX = '.tmp-'
+TMP_MAX_AGE = 3600
+
+# Arrays of the compiled grid layout stored next to the encoded tables
+LAYOUT_ARRAYS = ['index', 'terminal', 'terminal_rewards', 'neighbours']
+
+def load_problem(file_path, cache_dir=None):
+    """Read a problem file through a binary cache of its parsed and compiled form.
+
+    Entries live in cache_dir (by default __mdpcache__ next to the file) and
+    hold the encoded grid and policy, the compiled grid layout as .npy files
+    and the parameters in a json file. Every version of a file gets its own
+    entry, named after its content hash, which is never modified once moved
+    in place; a json pointer keyed by the path of the file names the current
+    entry and is replaced atomically. The pointer is checked against the
+    mtime and size of the file; when those changed the content hash decides
+    whether the entry is still valid. Arrays are memory-mapped, so loading
+    does not copy them. Returns the problem as parsed with encode=True plus
+    its compiled grid under 'layout'. When the cache cannot be written (e.g.
+    a read-only checkout) or an entry disappears while it is read, the file
+    is parsed directly instead.
+    """
+    file_path = os.path.abspath(file_path)
+    try:
+        problem = load_cached(file_path, cache_dir)
+    except (OSError, ValueError):
+        problem = None
+    if problem is None:
+        problem = parse.read_grid_mdp_problem(file_path, encode=True)
+        if 'grid' in problem:
+            problem['layout'] = mdp.compile_grid(problem['grid'])
+    return problem
+
+def load_cached(file_path, cache_dir=None):
+    # The cached problem, written first if needed; None if the entry of the
+    # pointer is gone or unreadable
+    base = entry_path(file_path, cache_dir)
+    stat = os.stat(file_path)
+    pointer = read_meta(base + '.json')
+    if pointer is not None and (pointer['mtime_ns'], pointer['size']) != (stat.st_mtime_ns, stat.st_size):
+        if pointer['sha256'] == file_hash(file_path):
+            # Touched but unchanged, remember the new mtime
+            pointer['mtime_ns'], pointer['size'] = stat.st_mtime_ns, stat.st_size
+            write_json(base + '.json', pointer)
+        else:
+            pointer = None
+    if pointer is None:
+        pointer = write_entry(file_path, base, stat)
+    entry = os.path.join(os.path.dirname(base), pointer['entry'])
+    meta = read_meta(os.path.join(entry, 'meta.json'))
+    if meta is None:
+        return None
+    return load_entry(entry, meta)
+
+def entry_path(file_path, cache_dir=None):
+    # Path of the pointer (plus '.json') and prefix of the entries of a file
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(file_path), CACHE_DIR_NAME)
+    key = hashlib.sha1(file_path.encode()).hexdigest()[:16]
+    return os.path.join(cache_dir, os.path.basename(file_path) + '-' + key)
+
+def file_hash(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def read_meta(path):
+    try:
+        with open(path) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(meta, dict) or meta.get('version') != CACHE_VERSION:
+        return None
+    return meta
+
+def write_json(path, data):
+    # Write to a unique temporary file and rename it over path, so
+    # concurrent writers never interleave and readers see either version
+    fd, tmp = tempfile.mkstemp(prefix=TMP_PREFIX, dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp, path)
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+def write_entry(file_path, base, stat):
+    # Hash before parsing, so a file modified meanwhile is re-read next time
+    sha256 = file_hash(file_path)
+    entry = base + '-' + sha256[:16]
+    cache_dir = os.path.dirname(base)
+    os.makedirs(cache_dir, exist_ok=True)
+    if read_meta(os.path.join(entry, 'meta.json')) is None:
+        problem = parse.read_grid_mdp_problem(file_path, encode=True)
+        layout = mdp.compile_grid(problem['grid']) if 'grid' in problem else None
+
+        # Build the entry in a temporary directory and move it in place, so
+        # concurrent readers never see a partial entry
+        tmp = tempfile.mkdtemp(prefix=TMP_PREFIX, dir=cache_dir)
+        meta = {
+            'version': CACHE_VERSION,
+            'sha256': sha256,
+            'params': {key: problem[key] for key in parse.KEYS if key in problem},
+            'tokens': {},
+        }
+        try:
+            for key in parse.SECTIONS:
+                if key in problem:
+                    meta['tokens'][key] = problem[key]['tokens']
+                    np.save(os.path.join(tmp, key + '.npy'), problem[key]['codes'])
+            if layout is not None:
+                for name in LAYOUT_ARRAYS:
+                    np.save(os.path.join(tmp, name + '.npy'), layout[name])
+            write_json(os.path.join(tmp, 'meta.json'), meta)
+            os.rename(tmp, entry)
+        except OSError:
+            shutil.rmtree(tmp, ignore_errors=True)
+            # Another process moved the same version in place first
+            if read_meta(os.path.join(entry, 'meta.json')) is None:
+                raise
+
+    pointer = {
+        'version': CACHE_VERSION,
+        'path': file_path,
+        'mtime_ns': stat.st_mtime_ns,
+        'size': stat.st_size,
+        'sha256': sha256,
+        'entry': os.path.basename(entry),
+    }
+    write_json(base + '.json', pointer)
+    prune(base, entry)
+    return pointer
+
+def prune(base, entry):
+    # Remove the other versions of the file and the temporaries of crashed
+    # writers. A reader still using a removed version falls back to parsing
+    cache_dir, prefix = os.path.split(base)
+    now = time.time()
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        if name.startswith(TMP_PREFIX):
+            try:
+                stale = now - os.path.getmtime(path) > TMP_MAX_AGE
+            except OSError:
+                continue
+        else:
+            stale = name.startswith(prefix + '-') and path != entry
+        if stale:
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+def load_entry(entry, meta):
+    problem = dict(meta['params'])
+    for key, tokens in meta['tokens'].items():
+        codes = np.load(os.path.join(entry, key + '.npy'), mmap_mode='r')
+        problem[key] = {'tokens': tokens, 'codes': codes}
+    if 'grid' in problem:
+        layout = {name: np.load(os.path.join(entry, name + '.npy'), mmap_mode='r') for name in LAYOUT_ARRAYS}
+        rows, cols = layout['index'].shape
+        cell_rows, cell_cols = np.nonzero(layout['index'] >= 0)
+        layout['rows'], layout['cols'] = rows, cols
+        layout['cells'] = list(zip(cell_rows.tolist(), cell_cols.tolist()))
+        problem['layout'] = layout
+    return problem
+
+def read_grid_mdp_problem_p1(file_path, cache_dir=None):
+    # p1 renders the grid cells, so its tables are decoded back to strings
+    problem = load_problem(file_path, cache_dir)
+    return {
+        'seed': problem.get('seed'),
+        'noise': problem.get('noise'),
+        'livingReward': problem.get('livingReward'),
+        'grid': parse.decode_table(problem['grid']) if 'grid' in problem else [],
+        'policy': parse.decode_table(problem['policy']) if 'policy' in problem else [],
+        'layout': problem.get('layout'),
+    }
+
+def read_grid_mdp_problem_p2(file_path, cache_dir=None):
+    return load_problem(file_path, cache_dir)
+
+def read_grid_mdp_problem_p3(file_path, cache_dir=None):
+    return load_problem(file_path, cache_dir)
@@ -0,0 +1,305 @@
+import warnings
+import numpy as np
+import parse
+
+# Compass directions in clockwise order, so that slipping left/right of an
+# intended direction d is simply (d - 1) % 4 / (d + 1) % 4
+DIRECTIONS = ['N', 'E', 'S', 'W']
+DIRECTION_INDICES = {'N': 0, 'E': 1, 'S': 2, 'W': 3}
+DIRECTION_EFFECTS = [(-1, 0), (0, 1), (1, 0), (0, -1)]
+
+WALLS = ['#', '#####']
+
+def is_wall(cell):
+    return cell in WALLS
+
+def terminal_reward(cell):
+    # Numeric cells are terminal states, their value is the exit reward
+    if cell in ['_', 'S'] or is_wall(cell):
+        return None
+    try:
+        return float(cell)
+    except ValueError:
+        return None
+
+def compile_grid(grid):
+    """Integer-index the non-wall cells of a parsed grid once.
+
+    grid is either a list of lists of cell strings or a table encoded by
+    parse. Returns a dict holding the cell <-> index maps, the terminal mask
+    and rewards, and for every cell the index reached by moving in each of
+    the four DIRECTIONS (the cell itself when bumping into a wall or the
+    border).
+    """
+    if not parse.is_encoded(grid):
+        grid = parse.encode_table(grid)
+    tokens, codes = grid['tokens'], grid['codes']
+    rows, cols = codes.shape
+
+    # Classify every distinct token once, then the whole grid by lookup
+    token_rewards = [terminal_reward(token) for token in tokens]
+    token_walls = np.array([is_wall(token) for token in tokens] + [False])
+    token_terminal = np.array([reward is not None for reward in token_rewards] + [False])
+    token_rewards = np.array([reward or 0.0 for reward in token_rewards] + [0.0])
+
+    mask = ~token_walls[codes]
+    num_states = int(np.count_nonzero(mask))
+    index = np.full((rows, cols), -1, dtype=np.int64)
+    index[mask] = np.arange(num_states)
+    cell_rows, cell_cols = np.nonzero(mask)
+    cells = list(zip(cell_rows.tolist(), cell_cols.tolist()))
+
+    states = np.arange(num_states)
+    padded = np.pad(index, 1, constant_values=-1)
+    neighbours = np.empty((num_states, 4), dtype=np.int64)
+    for d, (di, dj) in enumerate(DIRECTION_EFFECTS):
+        moved = padded[1 + di:1 + di + rows, 1 + dj:1 + dj + cols][mask]
+        neighbours[:, d] = np.where(moved >= 0, moved, states)
+
+    return {
+        'rows': rows,
+        'cols': cols,
+        'index': index,
+        'cells': cells,
+        'terminal': token_terminal[codes][mask],
+        'terminal_rewards': token_rewards[codes][mask],
+        'neighbours': neighbours,
+    }
+
+def compile_model(grid, noise, livingReward, layout=None):
+    """Precompute the transition table of the grid MDP.
+
+    next_states[s, a, k] is the state reached from s when intending
+    DIRECTIONS[a] and the k-th outcome happens (0 = intended, 1 = slip left,
+    2 = slip right), with probability probs[k]. Pass an already compiled
+    layout to share it between models that only differ in their parameters.
+    """
+    if layout is None:
+        layout = compile_grid(grid)
+    d = np.arange(4)
+    outcomes = np.stack([d, (d - 1) % 4, (d + 1) % 4], axis=1)
+    model = dict(layout)
+    model['noise'] = noise
+    model['livingReward'] = livingReward
+    model['next_states'] = layout['neighbours'][:, outcomes]
+    model['probs'] = np.array([1 - 2 * noise, noise, noise])
+    return model
+
+def compile_policy(model, policy):
+    # Direction index of the policy action of every state, -1 for states
+    # that are not updated ('exit', '#' or anything that is not a move)
+    if not parse.is_encoded(policy):
+        policy = parse.encode_table(policy)
+    token_codes = np.array([DIRECTION_INDICES.get(token, -1) for token in policy['tokens']] + [-1])
+    return token_codes[policy['codes']][model['index'] >= 0].astype(np.int64)
+
+def q_values(model, V, discount, next_states=None):
+    """Q[..., s, a] for every state and intended direction.
+
+    The outcomes are accumulated one after the other so the sums are
+    bit-identical to a scalar loop over (prob, next_state) pairs. V may
+    carry leading batch axes, and so may discount and the model's
+    livingReward and probs (outcomes on the last axis) as long as they
+    broadcast against Q. next_states defaults to the model's; pass a slice
+    of it (rows of states, columns of directions) to back up only those.
+    """
+    if next_states is None:
+        next_states = model['next_states']
+    probs = model['probs']
+    livingReward = model['livingReward']
+    Q = 0.0
+    for k in range(3):
+        Q = Q + probs[..., k] * (livingReward + discount * V[..., next_states[..., k]])
+    return Q
+
+def policy_next_states(model, codes):
+    # next_states[..., s, k] of the policy action of every state, for codes
+    # with any leading batch axes; states without a move get the outcomes of
+    # direction 0, which policy_backup ignores
+    states = np.arange(len(model['cells']))
+    return model['next_states'][states, np.maximum(codes, 0)]
+
+def policy_backup(model, V, discount, codes, next_states=None):
+    """One synchronous backup of V under a fixed policy.
+
+    V and codes may carry the same leading batch axes, one policy per row;
+    next_states is policy_next_states(model, codes), computed here when not
+    given. Accumulates like q_values.
+    """
+    if next_states is None:
+        next_states = policy_next_states(model, codes)
+    probs = model['probs']
+    livingReward = model['livingReward']
+    value = 0.0
+    for k in range(3):
+        value = value + probs[..., k] * (livingReward + discount * np.take_along_axis(V, next_states[..., k], axis=-1))
+    V_new = np.where(codes >= 0, value, V)
+    terminal = model['terminal']
+    V_new[..., terminal] = model['terminal_rewards'][terminal]
+    return V_new
+
+def compile_stencil(model):
+    """2-D masks for backing up the whole grid with shifted-array operations.
+
+    blocked[d] marks the cells whose move in DIRECTIONS[d] bumps into a wall
+    or the border (the agent stays put), so neighbour values can be read with
+    a plain roll of the value grid and no index gathers.
+    """
+    rows, cols = model['rows'], model['cols']
+    mask = model['index'] >= 0
+    states = np.arange(len(model['cells']))
+    blocked = np.ones((4, rows, cols), dtype=bool)
+    for d in range(4):
+        blocked[d][mask] = model['neighbours'][:, d] == states
+    terminal = np.zeros((rows, cols), dtype=bool)
+    terminal[mask] = model['terminal']
+    rewards = np.zeros((rows, cols))
+    rewards[mask] = model['terminal_rewards']
+    stencil = dict(model)
+    stencil['mask'] = mask
+    stencil['blocked'] = blocked
+    stencil['terminal_grid'] = terminal
+    stencil['terminal_rewards_grid'] = rewards
+    return stencil
+
+def shifted_values(stencil, V):
+    # neighbours[d][i, j] is the value of the cell reached from (i, j) by
+    # moving in DIRECTIONS[d]
+    neighbours = np.empty((4,) + V.shape)
+    for d, (di, dj) in enumerate(DIRECTION_EFFECTS):
+        shifted = np.roll(V, (-di, -dj), axis=(0, 1))
+        neighbours[d] = np.where(stencil['blocked'][d], V, shifted)
+    return neighbours
+
+def grid_q_values(stencil, V, discount):
+    # Same backup as q_values, on a rows x cols value grid: Q[a] is the grid
+    # of action values for intended direction DIRECTIONS[a]
+    neighbours = shifted_values(stencil, V)
+    probs = stencil['probs']
+    livingReward = stencil['livingReward']
+    Q = np.zeros((4,) + V.shape)
+    for a in range(4):
+        for k, d in enumerate([a, (a - 1) % 4, (a + 1) % 4]):
+            Q[a] += probs[k] * (livingReward + discount * neighbours[d])
+    return Q
+
+def policy_system(model, discount, codes):
+    """Sparse (I - discount * P^pi) matrix and right-hand side of the policy.
+
+    Terminal states are pinned to their exit reward and states without a
+    move ('exit' on a non-terminal, '#') keep their initial value of zero,
+    exactly like the fixed points of policy_backup.
+    """
+    sp, _ = import_sparse()
+
+    num_states = len(model['cells'])
+    states = np.nonzero((codes >= 0) & ~model['terminal'])[0]
+    next_states = model['next_states'][states, codes[states]]
+    probs = model['probs']
+
+    rows = np.concatenate([np.arange(num_states), np.repeat(states, 3)])
+    cols = np.concatenate([np.arange(num_states), next_states.ravel()])
+    data = np.concatenate([np.ones(num_states), np.tile(-discount * probs, len(states))])
+    # Duplicate (row, col) pairs, e.g. bumping into a wall twice, are summed
+    A = sp.csr_matrix((data, (rows, cols)), shape=(num_states, num_states))
+
+    b = np.zeros(num_states)
+    b[states] = model['livingReward'] * probs.sum()
+    terminal = model['terminal']
+    b[terminal] = model['terminal_rewards'][terminal]
+    return A, b
+
+# scipy is an optional dependency, only needed for exact policy evaluation;
+# the rtol argument of its Krylov solvers appeared in 1.12
+SCIPY_MIN_VERSION = (1, 12)
+
+def import_sparse():
+    # scipy.sparse and scipy.sparse.linalg, or an ImportError naming the
+    # missing optional dependency
+    message = "Exact policy evaluation needs scipy >= {}.{} (pip install 'scipy>={}.{}')".format(
+        *SCIPY_MIN_VERSION, *SCIPY_MIN_VERSION)
+    try:
+        import scipy, scipy.sparse, scipy.sparse.linalg
+    except ImportError:
+        raise ImportError(message) from None
+    if tuple(int(part) for part in scipy.__version__.split('.')[:2]) < SCIPY_MIN_VERSION:
+        raise ImportError(message + ", found {}".format(scipy.__version__))
+    return scipy.sparse, scipy.sparse.linalg
+
+# Above this many states 'auto' switches from a sparse LU factorisation to
+# GMRES, whose memory use stays linear in the number of states
+DIRECT_SOLVE_LIMIT = 250000
+
+def solve_policy(model, discount, codes, solver='auto', tol=1e-10):
+    """Solve for the fixed point V^pi of the policy in one call.
+
+    Raises when the system is singular, which happens with discount 1 when
+    the policy never reaches a terminal from some state, or when an
+    iterative solver does not converge.
+    """
+    _, spla = import_sparse()
+
+    A, b = policy_system(model, discount, codes)
+    if solver == 'auto':
+        solver = 'direct' if len(b) <= DIRECT_SOLVE_LIMIT else 'gmres'
+    if solver == 'direct':
+        # A singular matrix gives NaNs and a MatrixRankWarning, checked below
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', spla.MatrixRankWarning)
+            V = spla.spsolve(A.tocsc(), b)
+        info = 0
+    elif solver == 'gmres':
+        V, info = spla.gmres(A, b, rtol=tol, atol=0.0, restart=50, maxiter=len(b))
+    elif solver == 'bicgstab':
+        V, info = spla.bicgstab(A, b, rtol=tol, atol=0.0, maxiter=len(b))
+    else:
+        raise ValueError("Unknown solver: {}".format(solver))
+    if info != 0:
+        raise Exception("{} did not converge ({})".format(solver, info))
+    if not np.all(np.isfinite(V)):
+        raise Exception("The policy system is singular, the policy does not reach a terminal state")
+    return V
+
+def max_residual(V_new, V):
+    # Max-norm Bellman residual between two successive value functions
+    if V.size == 0:
+        return 0.0
+    return float(np.max(np.abs(V_new - V)))
+
+def convergence_report(k, residual, tolerance):
+    if residual < tolerance:
+        return "Converged at k={} (residual {:.2e} < {:.2e})".format(k, residual, tolerance)
+    return "Not converged at k={} (residual {:.2e} >= {:.2e})".format(k, residual, tolerance)
+
+def weighted_predecessors(model):
+    # For every state s, the (p, P(s|p)) of the states whose backup reads
+    # V(s), P(s|p) being the largest probability over the actions of p of
+    # reaching s
+    weights = [{} for _ in model['cells']]
+    probs = model['probs'].tolist()
+    for p in np.nonzero(~model['terminal'])[0].tolist():
+        for outcomes in model['next_states'][p].tolist():
+            reach = {}
+            for prob, s in zip(probs, outcomes):
+                reach[s] = reach.get(s, 0.0) + prob
+            for s, prob in reach.items():
+                weights[s][p] = max(weights[s].get(p, 0.0), prob)
+    return [sorted((p, prob) for p, prob in w.items() if prob > 0) for w in weights]
+
+def select_snapshots(items, snapshots='all'):
+    """Lazily filter the (k, ...) items of a sweep generator.
+
+    snapshots is 'all', 'last' or an int n to keep every n-th iteration;
+    the last item is always kept. Items are passed through as they come,
+    holding back only one item to know which one is last.
+    """
+    if snapshots not in ['all', 'last'] and not (isinstance(snapshots, int) and snapshots > 0):
+        raise ValueError("Unknown snapshots: {}".format(snapshots))
+    previous = None
+    for item in items:
+        if previous is not None:
+            if snapshots == 'all' or (snapshots != 'last' and previous[0] % snapshots == 0):
+                yield previous
+        previous = item
+    if previous is not None:
+        yield previous
@@ -0,0 +1,47 @@
+import csv, json, time
+
+# Metrics passed to a sweep callback, in CSV column order
+FIELDS = ['iteration', 'elapsed', 'backups', 'residual', 'policy_changes']
+
+def observe(sweeps, callback, unpack):
+    """Yield the items of a sweep generator, calling callback after each sweep.
+
+    unpack(item) returns (iteration, residual, total backups so far, greedy
+    actions or None). callback gets a dict with the FIELDS: elapsed is the
+    time spent inside the solver since the start (time spent by the consumer
+    between sweeps is not counted), backups and policy_changes are those of
+    this sweep. Items that did no backup yet (an initial V) are not reported.
+    """
+    elapsed = 0.0
+    previous_backups = 0
+    previous_best = None
+    start = time.perf_counter()
+    for item in sweeps:
+        elapsed += time.perf_counter() - start
+        iteration, residual, backups, best = unpack(item)
+        if backups > 0:
+            if best is None or previous_best is None:
+                policy_changes = 0 if best is None else len(best)
+            else:
+                policy_changes = int((best != previous_best).sum())
+            callback({
+                'iteration': iteration,
+                'elapsed': elapsed,
+                'backups': backups - previous_backups,
+                'residual': residual,
+                'policy_changes': policy_changes,
+            })
+            previous_backups = backups
+            previous_best = None if best is None else best.copy()
+        yield item
+        start = time.perf_counter()
+
+def write_csv(records, file_path):
+    with open(file_path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=FIELDS)
+        writer.writeheader()
+        writer.writerows(records)
+
+def write_json(records, file_path):
+    with open(file_path, 'w') as f:
+        json.dump(records, f, indent=2)
@@ -1,6 +1,22 @@
-import sys, grader, parse
+import sys, grader, cache
+import bisect, itertools, random
+import numpy as np
+import mdp
 
 def play_episode(problem):
+    return '\n'.join(episode_lines(problem)).rstrip()
+
+def write_episode(problem, file):
+    # Stream the trace to a file object as it is produced
+    for line in episode_lines(problem):
+        file.write(line + '\n')
+
+def episode_lines(problem):
+    """Play one episode, yielding its trace line by line as it goes.
+
+    Joined with newlines the lines are the trace returned by play_episode;
+    a grid snapshot is yielded as a single multi-line block.
+    """
     # Extract the problem components
     seed = problem['seed']
     noise = problem['noise']
@@ -10,69 +26,22 @@ def play_episode(problem):
 
     # Initialize the random number generator
     if seed != -1:
-        import random
         random.seed(seed, version=1)
 
-    # Process the grid to create a 2D array, find start state
-    num_rows = len(grid_array)
-    num_cols = len(grid_array[0])  # assuming rectangular grid
-
-    # Find the start state
+    # Precompute the transitions of every cell, find start state
+    step, cells = make_stepper(grid_array, noise, problem.get('layout'))
     start_state = None
-    for i in range(num_rows):
-        for j in range(num_cols):
-            if grid_array[i][j] == 'S':
-                start_state = (i, j)
+    for s, (i, j) in enumerate(cells):
+        if grid_array[i][j] == 'S':
+            start_state = s
     if start_state is None:
         raise Exception("Start state not found")
 
     # Initialize the cumulative reward
     cumulative_reward = 0.0
-    experience = ''
 
     # Function to print the grid with the agent's position
-    def print_grid(agent_pos, show_agent=True):
-        output = ''
-        for i in range(num_rows):
-            row_output = '    '  # 4 spaces at the start of each line
-            for j in range(num_cols):
-                cell_content = grid_array[i][j]
-                if (i, j) == agent_pos and show_agent:
-                    cell = 'P'
-                else:
-                    cell = cell_content
-                if j < num_cols - 1:
-                    # Not the last column
-                    cell_str = '{:<5}'.format(cell)  # Fixed width of 5
-                else:
-                    # Last column
-                    if len(cell) >= 2:
-                        # Value length is 2: left-align within 4 characters
-                        cell_str = '{:<4}'.format(cell)
-                        row_output = row_output[:-(len(cell)-1)]  # Remove the extra space
-                    else:
-                        # Other cases: left-align within 5 characters
-                        cell_str = '{:<5}'.format(cell)
-                row_output += cell_str
-            output += row_output.rstrip() + '\n'
-        return output.rstrip()
-    
-    def print_grid(agent_pos, show_agent=True):
-        output = ''
-        for i in range(num_rows):
-            row_output = ''  # 4 spaces at the start of each line
-            if len(grid_array[i][0]) > 1:
-                row_output = row_output[:-(len(cell_content) - 1)]
-            for j in range(num_cols):
-                cell_content = grid_array[i][j]
-                if (i, j) == agent_pos and show_agent:
-                    cell = 'P'
-                else:
-                    cell = cell_content
-                cell = " " * (5 - len(cell)) + cell
-                row_output += cell
-            output = output + row_output + '\n'
-        return output.rstrip()
+    print_grid = make_grid_renderer(grid_array)
 
     # Function to format numbers appropriately
     def format_number(num):
@@ -83,95 +52,185 @@ def play_episode(problem):
             return str(num)
 
     # Output the start state
-    experience += 'Start state:\n'
-    experience += print_grid(start_state) + '\n'
-    experience += 'Cumulative reward sum: {}\n'.format(format_number(cumulative_reward))
-    experience += '-------------------------------------------- \n'
+    yield 'Start state:'
+    yield print_grid(cells[start_state])
+    yield 'Cumulative reward sum: {}'.format(format_number(cumulative_reward))
+    yield '-------------------------------------------- '
 
     # Begin the episode
     current_state = start_state
     terminal = False
     while not terminal:
         # Get the intended action from the policy
-        i, j = current_state
+        i, j = cells[current_state]
         intended_action = policy_array[i][j]
         current_cell = grid_array[i][j]
         if intended_action == 'exit':
             try:
                 # Attempt to parse the current cell's value as float
                 reward = float(current_cell)
-                cumulative_reward += reward
-                # Output the action, reward, new state, cumulative reward
-                experience += 'Taking action: {} (intended: {})\n'.format('exit', 'exit')
-                experience += 'Reward received: {}\n'.format(format_number(reward))
-                experience += 'New state:\n'
-                # After exiting, the agent is no longer on the grid
-                experience += print_grid(current_state, show_agent=False) + '\n'
-                experience += 'Cumulative reward sum: {}'.format(format_number(cumulative_reward))
-                terminal = True
             except ValueError:
                 # If the current cell is not a numerical terminal state, cannot exit
-                experience += 'Attempted to exit from a non-terminal cell.\n'
-                experience += 'Cumulative reward sum: {}'.format(format_number(cumulative_reward))
+                yield 'Attempted to exit from a non-terminal cell.'
+                yield 'Cumulative reward sum: {}'.format(format_number(cumulative_reward))
                 # Optionally, you can choose to end the episode or handle it differently
                 terminal = True  # To prevent infinite loop
+            else:
+                cumulative_reward += reward
+                # Output the action, reward, new state, cumulative reward
+                yield 'Taking action: {} (intended: {})'.format('exit', 'exit')
+                yield 'Reward received: {}'.format(format_number(reward))
+                yield 'New state:'
+                # After exiting, the agent is no longer on the grid
+                yield print_grid(cells[current_state], show_agent=False)
+                yield 'Cumulative reward sum: {}'.format(format_number(cumulative_reward))
+                terminal = True
         else:
-            # Determine the actual action taken, considering noise
-            actual_action = get_actual_action(intended_action, noise)
-            # Compute the next state
-            next_state = get_next_state(current_state, actual_action, grid_array)
+            # Determine the actual action taken, considering noise, and
+            # the next state
+            actual_action, next_state = step(current_state, intended_action)
             # Get the reward
             reward = livingReward
             cumulative_reward += reward
             # Output the action, reward, new state, cumulative reward
-            experience += 'Taking action: {} (intended: {})\n'.format(actual_action, intended_action)
-            experience += 'Reward received: {}\n'.format(format_number(reward))
-            experience += 'New state:\n'
-            experience += print_grid(next_state) + '\n'
-            experience += 'Cumulative reward sum: {}\n'.format(format_number(cumulative_reward))
-            experience += '-------------------------------------------- \n'
+            yield 'Taking action: {} (intended: {})'.format(actual_action, intended_action)
+            yield 'Reward received: {}'.format(format_number(reward))
+            yield 'New state:'
+            yield print_grid(cells[next_state])
+            yield 'Cumulative reward sum: {}'.format(format_number(cumulative_reward))
+            yield '-------------------------------------------- '
             # Update the current state
             current_state = next_state
-    return experience.rstrip()
+
+def simulate_episodes(problem, num_episodes, max_steps=10000, seed=None):
+    """Simulate many episodes of the policy at once, without traces.
+
+    All episodes advance in lockstep, drawing one uniform number per live
+    episode and step from a NumPy generator and looking next states up in
+    the compiled transition table. This follows the same dynamics as
+    play_episode but not its random stream, so individual episodes differ
+    from the seeded traces. Returns the return and length (number of
+    actions, exit included) of every episode, how many were cut off at
+    max_steps and how often every cell was occupied.
+    """
+    noise = problem['noise']
+    livingReward = problem['livingReward']
+    grid_array = problem['grid']
+    policy_array = problem['policy']
+    if seed is None and problem['seed'] != -1:
+        seed = problem['seed']
+    rng = np.random.default_rng(seed)
+
+    model = mdp.compile_model(grid_array, noise, livingReward, problem.get('layout'))
+    num_states = len(model['cells'])
+    start_state = None
+    exits = np.zeros(num_states, dtype=bool)
+    codes = np.zeros(num_states, dtype=np.int64)
+    for s, (i, j) in enumerate(model['cells']):
+        if grid_array[i][j] == 'S':
+            start_state = s
+        action = policy_array[i][j]
+        if action == 'exit':
+            exits[s] = True
+        else:
+            codes[s] = mdp.DIRECTION_INDICES[action]
+    if start_state is None:
+        raise Exception("Start state not found")
+    # Exiting from a non-terminal cell ends the episode without a reward
+    exit_rewards = np.where(model['terminal'], model['terminal_rewards'], 0.0)
+    cumulative_probs = np.cumsum(model['probs'])
+
+    states = np.full(num_episodes, start_state, dtype=np.int64)
+    returns = np.zeros(num_episodes)
+    lengths = np.zeros(num_episodes, dtype=np.int64)
+    visits = np.bincount(states, minlength=num_states)
+    live = np.arange(num_episodes)
+    for step in range(max_steps):
+        if len(live) == 0:
+            break
+        current = states[live]
+        exiting = exits[current]
+        lengths[live] += 1
+
+        done = live[exiting]
+        returns[done] += exit_rewards[current[exiting]]
+
+        live = live[~exiting]
+        current = current[~exiting]
+        outcomes = np.searchsorted(cumulative_probs, rng.random(len(live)), side='right')
+        outcomes = np.minimum(outcomes, 2)
+        next_states = model['next_states'][current, codes[current], outcomes]
+        states[live] = next_states
+        returns[live] += livingReward
+        visits += np.bincount(next_states, minlength=num_states)
+
+    cell_visits = np.zeros((model['rows'], model['cols']), dtype=np.int64)
+    cell_visits[model['index'] >= 0] = visits
+    return {
+        'returns': returns,
+        'lengths': lengths,
+        'truncated': len(live),
+        'visits': cell_visits,
+    }
 
 # Helper functions
-def get_actual_action(intended_action, noise):
-    import random
-    d = {'N':['N', 'E', 'W'], 'E':['E', 'S', 'N'], 'S':['S', 'W', 'E'], 'W':['W', 'N', 'S']}
-    weights = [1 - 2 * noise, noise, noise]
-    actual_action = random.choices(population=d[intended_action], weights=weights)[0]
-    return actual_action
-
-def get_next_state(current_state, action, grid_array):
-    num_rows = len(grid_array)
-    num_cols = len(grid_array[0])
-    i, j = current_state
-    action_effects = {'N': (-1, 0), 'S': (1, 0), 'E': (0, 1), 'W': (0, -1)}
-    if action not in action_effects:
-        return current_state
-    di, dj = action_effects[action]
-    new_i = i + di
-    new_j = j + dj
-    if new_i < 0 or new_i >= num_rows or new_j < 0 or new_j >= num_cols:
-        return current_state
-    if grid_array[new_i][new_j] == '#':
-        return current_state
-    else:
-        return (new_i, new_j)
-
-def get_reward(current_state, intended_action, grid_array, livingReward):
-    i, j = current_state
-    current_cell = grid_array[i][j]
-    if intended_action == 'exit':
-        try:
-            return float(current_cell)
-        except ValueError:
-            return 0.0  # Or handle as needed
-    else:
-        return livingReward
+def make_stepper(grid_array, noise, layout=None):
+    """Return step(state, intended_action) -> (actual_action, next_state) and the cells.
+
+    States index the non-wall cells (see mdp.compile_grid), whose (i, j) is
+    cells[state]. step draws the outcome the way random.choices does with
+    the weights of the intended direction and the slips to its right and
+    left: one random.random() scaled by the total weight and bisected into
+    the cumulative weights, which are computed once. The next state is read
+    from the neighbours of the compiled grid, so seeded traces stay the same
+    as with per-step random.choices without any per-cell setup.
+    """
+    if layout is None:
+        layout = mdp.compile_grid(grid_array)
+    neighbours = layout['neighbours']
+    # Intended, slip right, slip left
+    turns = [0, 1, -1]
+
+    cum_weights = list(itertools.accumulate([1 - 2 * noise, noise, noise]))
+    total = cum_weights[-1] + 0.0
+    if not total > 0.0 or total == float('inf'):
+        raise ValueError('Total of weights must be greater than zero')
+    hi = len(cum_weights) - 1
+
+    def step(state, intended_action):
+        turn = turns[bisect.bisect(cum_weights, random.random() * total, 0, hi)]
+        d = (mdp.DIRECTION_INDICES[intended_action] + turn) % 4
+        return mdp.DIRECTIONS[d], int(neighbours[state, d])
+
+    return step, layout['cells']
+
+def make_grid_renderer(grid_array):
+    """Return a print_grid(agent_pos, show_agent=True) function for the grid.
+
+    Every cell is right-aligned in 5 characters. The rows without the agent
+    are formatted once; each call only re-renders the row the agent left and
+    the row it is in.
+    """
+    cells = [[' ' * (5 - len(cell)) + cell for cell in row] for row in grid_array]
+    static_rows = [''.join(row) for row in cells]
+    rows = list(static_rows)
+    agent_row = [None]  # Row currently drawn with the agent
+
+    def print_grid(agent_pos, show_agent=True):
+        if agent_row[0] is not None:
+            rows[agent_row[0]] = static_rows[agent_row[0]]
+            agent_row[0] = None
+        if show_agent and agent_pos is not None:
+            i, j = agent_pos
+            row = cells[i]
+            rows[i] = ''.join(row[:j]) + '    P' + ''.join(row[j + 1:])
+            agent_row[0] = i
+        return '\n'.join(rows).rstrip()
+
+    return print_grid
 
 if __name__ == "__main__":
     test_case_id = int(sys.argv[1])
     #test_case_id = 1
     problem_id = 1
-    grader.grade(problem_id, test_case_id, play_episode, parse.read_grid_mdp_problem_p1)
+    grader.grade(problem_id, test_case_id, play_episode, cache.read_grid_mdp_problem_p1)
@@ -1,6 +1,21 @@
-import sys, grader, parse
+import sys, grader, cache
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import mdp, metrics, warmstart
 
-def policy_evaluation(problem):
+def policy_evaluation(problem, tolerance=None, callback=None, snapshots='all', values=None):
+    return '\n'.join(policy_evaluation_snapshots(problem, tolerance, callback, snapshots, values))
+
+def policy_evaluation_snapshots(problem, tolerance=None, callback=None, snapshots='all', values=None):
+    """Lazily render the requested iterations of policy_evaluation.
+
+    Yields the text of every selected iteration (see mdp.select_snapshots)
+    and, with a tolerance, the convergence report; other iterations are
+    never formatted. values, if given, is a warmstart cache: the sweeps
+    start from the nearest cached V of the same grid and policy, and the
+    last V is stored back.
+    """
     # Extract parameters
     discount = problem['discount']
     noise = problem['noise']
@@ -8,108 +23,130 @@ def policy_evaluation(problem):
     iterations = problem['iterations']
     grid = problem['grid']
     policy = problem['policy']
-    
-    num_rows = len(grid)
-    num_cols = len(grid[0])
 
-    # Initialize value function V(s) to zero for all states
-    V = [[0.0 for _ in range(num_cols)] for _ in range(num_rows)]
-    
-    # Identify terminal states and their rewards
-    terminal_states = {}
-    for y in range(num_rows):
-        for x in range(num_cols):
-            cell = grid[y][x]
-            if cell not in ['_', 'S', '#', '#####']:
-                try:
-                    reward = float(cell)
-                    terminal_states[(y, x)] = reward
-                except ValueError:
-                    pass  # Ignore non-reward cells
-
-    outputs = []
-    for k in range(iterations):
+    # Compile the grid and the policy into a transition table once
+    model = mdp.compile_model(grid, noise, livingReward, problem.get('layout'))
+    codes = mdp.compile_policy(model, policy)
+
+    V0 = None
+    if values is not None:
+        key = warmstart.fingerprint(model, codes)
+        V0 = warmstart.lookup_values(values, key, problem)
+
+    k, V, residual = 0, None, float('inf')
+    sweeps = policy_evaluation_sweeps(model, discount, codes, iterations, tolerance, callback, V0)
+    for k, V, residual in mdp.select_snapshots(sweeps, snapshots):
         # Print V(s)
-        outputs.append(f"V^pi_k={k}")
-        formatted_grid = []
-        for y in range(num_rows):
-            formatted_row = []
-            for x in range(num_cols):
-                cell = grid[y][x]
-                if cell == '#' or cell == '#####':
-                    formatted_row.append('#####')
-                else:
-                    val = V[y][x]
-                    formatted_row.append("{0:7.2f}".format(val))
-            formatted_grid.append(formatted_row)
-        outputs.append(format_grid(formatted_grid))
-
-        V_new = [[0.0 for _ in range(num_cols)] for _ in range(num_rows)]
-        for y in range(num_rows):
-            for x in range(num_cols):
-                s = (y, x)
-                cell = grid[y][x]
-                action = policy[y][x]
-                if cell == '#' or cell == '#####' or action == '#':
-                    V_new[y][x] = V[y][x]  # Do not update walls
-                elif s in terminal_states:
-                    V_new[y][x] = terminal_states[s]
-                else:
-                    V_new[y][x] = compute_state_value(s, V, grid, policy, discount, noise, livingReward, terminal_states)
-        V = V_new
+        yield f"V^pi_k={k}\n" + format_values(V, model)
+
+    if values is not None and V is not None:
+        warmstart.store_values(values, key, problem, V)
 
-    return '\n'.join(outputs)
+    if tolerance is not None:
+        yield mdp.convergence_report(k, residual, tolerance)
 
-def compute_state_value(s, V, grid, policy, discount, noise, livingReward, terminal_states):
-    num_rows = len(grid)
-    num_cols = len(grid[0])
-    y, x = s
-    action = policy[y][x]
-    # Skip walls and invalid actions
-    if action == 'exit' or action == '#' or grid[y][x] == '#' or grid[y][x] == '#####':
-        return V[y][x]  # Should not update walls or terminal states
+def policy_evaluation_sweeps(model, discount, codes, iterations, tolerance=None, callback=None, V0=None):
+    """Run synchronous backups of the policy starting from V0 (default 0).
 
-    directions = {'N': (-1, 0), 'E': (0, 1), 'S': (1, 0), 'W': (0, -1)}
-    left_turn = {'N': 'W', 'E': 'N', 'S': 'E', 'W': 'S'}
-    right_turn = {'N': 'E', 'E': 'S', 'S': 'W', 'W': 'N'}
+    Yields (k, V, residual) for k = 0 .. iterations - 1, residual being the
+    max-norm change of the sweep that produced V (inf for k = 0). Stops early
+    once the residual falls below tolerance. callback, if given, is called
+    with the metrics.FIELDS of every sweep.
+    """
+    sweeps = evaluation_sweeps(model, discount, codes, iterations, tolerance, V0)
+    if callback is not None:
+        updated = int(np.count_nonzero(codes >= 0))
+        sweeps = metrics.observe(sweeps, callback, lambda item: (item[0], item[2], item[0] * updated, None))
+    return sweeps
 
-    intended_prob = 1 - 2 * noise
-    side_prob = noise
+def evaluation_sweeps(model, discount, codes, iterations, tolerance=None, V0=None):
+    # Initialize value function V(s) to zero for all states, or to V0
+    V = np.zeros(len(model['cells'])) if V0 is None else np.array(V0, dtype=float)
+    next_states = mdp.policy_next_states(model, codes)
+    residual = float('inf')
+    for k in range(iterations):
+        yield k, V, residual
+        if k == iterations - 1 or (tolerance is not None and residual < tolerance):
+            return
+        V_new = mdp.policy_backup(model, V, discount, codes, next_states)
+        residual = mdp.max_residual(V_new, V)
+        V = V_new
 
-    transitions = []
+def policy_evaluation_population(grid, policies, discount, noise, livingReward, iterations, tolerance=None,
+                                 layout=None, workers=None):
+    """Evaluate many policies of one grid together.
 
-    # Intended move
-    dy, dx = directions.get(action, (0, 0))
-    new_y, new_x = y + dy, x + dx
-    if is_valid_state(new_y, new_x, grid):
-        transitions.append(((new_y, new_x), intended_prob))
+    The grid is compiled once and V carries a leading policy axis, so every
+    sweep backs up all the policies at once; the values of each policy are
+    the same as those of policy_evaluation. With workers, the policies are
+    split into that many chunks evaluated in a process pool. Returns the
+    model of the grid and V, iterations (the last k) and residual, policy
+    axis first.
+    """
+    model = mdp.compile_model(grid, noise, livingReward, layout)
+    codes = np.zeros((len(policies), len(model['cells'])), dtype=np.int64)
+    for p, policy in enumerate(policies):
+        codes[p] = mdp.compile_policy(model, policy)
+
+    if workers is None or workers <= 1 or len(codes) <= 1:
+        result = population_sweeps(model, discount, codes, iterations, tolerance)
     else:
-        transitions.append(((y, x), intended_prob))
-    
-    # Side moves
-    for side_action in [left_turn.get(action, action), right_turn.get(action, action)]:
-        dy, dx = directions.get(side_action, (0, 0))
-        side_y, side_x = y + dy, x + dx
-        if is_valid_state(side_y, side_x, grid):
-            transitions.append(((side_y, side_x), side_prob))
-        else:
-            transitions.append(((y, x), side_prob))
-    
-    # Compute expected value
-    expected_value = 0.0
-    for (new_y, new_x), prob in transitions:
-        reward = livingReward
-        expected_value += prob * (reward + discount * V[new_y][new_x])
-    return expected_value
-
-def is_valid_state(y, x, grid):
-    num_rows = len(grid)
-    num_cols = len(grid[0])
-    if 0 <= y < num_rows and 0 <= x < num_cols:
-        cell = grid[y][x]
-        if cell != '#####' and cell != '#':
-            return True
-    return False
+        chunks = np.array_split(codes, min(workers, len(codes)))
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            parts = list(pool.map(population_sweeps, itertools.repeat(model), itertools.repeat(discount),
+                                  chunks, itertools.repeat(iterations), itertools.repeat(tolerance)))
+        result = {key: np.concatenate([part[key] for part in parts]) for key in ['V', 'iterations', 'residual']}
+    result['model'] = model
+    return result
+
+def population_sweeps(model, discount, codes, iterations, tolerance=None):
+    # Synchronous backups of every row of codes; with a tolerance, a policy
+    # stops being updated once its residual falls below it
+    num_policies, num_states = codes.shape
+    next_states = mdp.policy_next_states(model, codes)
+
+    V = np.zeros((num_policies, num_states))
+    last = np.zeros(num_policies, dtype=int)
+    residual = np.full(num_policies, np.inf)
+    active = np.ones(num_policies, dtype=bool)
+    for k in range(1, iterations):
+        rows = np.nonzero(active)[0]
+        V_active = V[rows]
+        V_new = mdp.policy_backup(model, V_active, discount, codes[rows], next_states[rows])
+
+        residual[rows] = np.max(np.abs(V_new - V_active), axis=1) if num_states else 0.0
+        V[rows], last[rows] = V_new, k
+        if tolerance is not None:
+            active[rows] = residual[rows] >= tolerance
+            if not active.any():
+                break
+
+    return {
+        'V': V,
+        'iterations': last,
+        'residual': residual,
+    }
+
+def exact_policy_evaluation(problem, solver='auto'):
+    # Converged value of the policy, solved directly instead of iterated
+    model = mdp.compile_model(problem['grid'], problem['noise'], problem['livingReward'], problem.get('layout'))
+    codes = mdp.compile_policy(model, problem['policy'])
+    V = mdp.solve_policy(model, problem['discount'], codes, solver)
+    return "V^pi\n" + format_values(V, model)
+
+def format_values(V, model):
+    index = model['index']
+    formatted_grid = []
+    for y in range(model['rows']):
+        formatted_row = []
+        for x in range(model['cols']):
+            s = index[y, x]
+            if s < 0:
+                formatted_row.append('#####')
+            else:
+                formatted_row.append("{0:7.2f}".format(V[s]))
+        formatted_grid.append(formatted_row)
+    return format_grid(formatted_grid)
 
 def format_grid(grid):
     # Helper function to format a single value
@@ -134,4 +171,4 @@ def format_grid(grid):
 if __name__ == "__main__":
     test_case_id = int(sys.argv[1])
     problem_id = 2
-    grader.grade(problem_id, test_case_id, policy_evaluation, parse.read_grid_mdp_problem_p2)
+    grader.grade(problem_id, test_case_id, policy_evaluation, cache.read_grid_mdp_problem_p2)
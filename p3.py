@@ -1,166 +1,266 @@
-import sys, grader, parse
-import copy
+import sys, grader, cache
+import heapq, itertools
+import numpy as np
+import mdp, metrics, parallel, warmstart
 
-def value_iteration(problem):
+# Actions, in the order ties are broken
+ACTIONS = ['N', 'S', 'W', 'E']
+ACTION_CODES = [mdp.DIRECTION_INDICES[a] for a in ACTIONS]
+
+def value_iteration(problem, engine='table', tolerance=None, schedule='synchronous', callback=None,
+                    snapshots='all', values=None, workers=None):
+    return '\n'.join(value_iteration_snapshots(problem, engine, tolerance, schedule, callback, snapshots, values,
+                                               workers))
+
+def value_iteration_snapshots(problem, engine='table', tolerance=None, schedule='synchronous', callback=None,
+                              snapshots='all', values=None, workers=None):
+    """Lazily render the requested iterations of value_iteration.
+
+    Yields the text of every selected iteration (see mdp.select_snapshots:
+    'all', 'last' or every n-th) and, with a tolerance, the convergence
+    report; iterations that are not selected are never formatted. Joined
+    with newlines, the default 'all' gives the full value_iteration output.
+    values, if given, is a warmstart cache: the sweeps start from the
+    nearest cached V of the same grid, and the last V is stored back.
+    """
     # Extract parameters from problem
     grid = problem['grid']
     discount = problem['discount']
     noise = problem['noise']
     livingReward = problem['livingReward']
     iterations = problem['iterations']
-    
-    # Grid dimensions
-    rows = len(grid)
-    cols = len(grid[0]) if rows > 0 else 0
-    
-    # Actions
-    actions = ['N', 'S', 'W', 'E']
-    action_indices = {'N': 0, 'S': 1, 'W': 2, 'E': 3}
-    directions = [(-1, 0), (1, 0), (0, -1), (0, 1)]  # N, S, W, E
-    
-    # Map to store V(s)
-    V = {}
-    policy = {}  # Policy map
-    
-    # Map to store the type of each cell
-    # Also, collect all the states
-    states = []
-    for i in range(rows):
-        for j in range(cols):
-            cell = grid[i][j]
-            if cell != '#':
-                state = (i, j)
-                states.append(state)
-                V[state] = 0.0  # Initialize V(s) = 0.0
-    
-    # Get terminal states and their rewards
-    terminal_states = {}
-    for i in range(rows):
-        for j in range(cols):
-            cell = grid[i][j]
-            if isinstance(cell, str) and cell.isnumeric():
-                reward = float(cell)
-                terminal_states[(i, j)] = reward
-    
-    return_value = ''
-    # Output V_k=0
-    return_value += f"V_k=0\n"
-    return_value += format_values(V, grid) + '\n'
-    
-    for k in range(iterations):
-        V_new = copy.deepcopy(V)
-        for state in states:
-            if state in terminal_states:
-                V_new[state] = terminal_states[state]
-                policy[state] = 'x'  # Terminal states have no policy
-            else:
-                max_value = float('-inf')
-                best_action = None
-                for a in actions:
-                    value = 0.0
-                    transitions = get_transitions(state, a, grid, noise, livingReward, terminal_states)
-                    for (prob, next_state, reward) in transitions:
-                        value += prob * (reward + discount * V[next_state])
-                    if value > max_value:
-                        max_value = value
-                        best_action = a
-                V_new[state] = max_value
-                policy[state] = best_action
-        V = copy.deepcopy(V_new)
-        
-        # Format and append the outputs
-        return_value += f"V_k={k+1}\n"
-        return_value += format_values(V, grid) + '\n'
-        return_value += f"pi_k={k+1}\n"
-        return_value += format_policy(policy, grid) + '\n'
-    
-    return return_value.strip()  # Remove the trailing newline
-
-def get_transitions(state, action, grid, noise, livingReward, terminal_states):
-    actions = ['N', 'S', 'W', 'E']
-    action_indices = {'N': 0, 'S': 1, 'W': 2, 'E': 3}
-    directions = [(-1, 0), (1, 0), (0, -1), (0, 1)]
-    
-    intended_index = action_indices[action]
-    intended_direction = directions[intended_index]
-    # Perpendicular directions
-    left_index = (intended_index - 1) % 4
-    right_index = (intended_index + 1) % 4
-    perpendicular_indices = [left_index, right_index]
-    
-    # Probabilities according to problem description
-    intended_prob = 1 - 2 * noise
-    perpendicular_prob = noise
-    
-    transitions = []
-    
-    # Intended action
-    next_state = move(state, intended_direction, grid)
-    reward = get_reward(state, next_state, livingReward, terminal_states)
-    transitions.append((intended_prob, next_state, reward))
-    
-    # Perpendicular actions
-    for idx in perpendicular_indices:
-        direction = directions[idx]
-        next_state = move(state, direction, grid)
-        reward = get_reward(state, next_state, livingReward, terminal_states)
-        transitions.append((perpendicular_prob, next_state, reward))
-    
-    return transitions
-
-def move(state, direction, grid):
-    rows = len(grid)
-    cols = len(grid[0])
-    i, j = state
-    di, dj = direction
-    new_i = i + di
-    new_j = j + dj
-    if 0 <= new_i < rows and 0 <= new_j < cols:
-        if grid[new_i][new_j] != '#':
-            return (new_i, new_j)
-    return state  # If move is into wall or outside grid, stay in same state
-
-def get_reward(state, next_state, livingReward, terminal_states):
-    if state in terminal_states:
-        return 0  # No reward if starting from terminal state
-    if next_state in terminal_states:
-        return terminal_states[next_state]
+
+    # Compile the grid into a transition table once
+    model = mdp.compile_model(grid, noise, livingReward, problem.get('layout'))
+
+    V0 = None
+    if values is not None:
+        key = warmstart.fingerprint(model)
+        V0 = warmstart.lookup_values(values, key, problem)
+
+    # V_k=0 comes first, it has no policy
+    initial = (0, np.zeros(len(model['cells'])) if V0 is None else V0, None, float('inf'), 0)
+    sweeps = value_iteration_sweeps(model, discount, iterations, engine, tolerance, schedule, callback, V0, workers)
+    for k, V, best, residual, backups in mdp.select_snapshots(itertools.chain([initial], sweeps), snapshots):
+        # Format the outputs
+        snapshot = f"V_k={k}\n" + format_values(V, model)
+        if best is not None:
+            snapshot += f"\npi_k={k}\n" + format_policy(greedy_policy(model, best), model)
+        yield snapshot
+
+    if values is not None:
+        warmstart.store_values(values, key, problem, V)
+
+    if tolerance is not None:
+        yield mdp.convergence_report(k, residual, tolerance)
+
+def value_iteration_sweeps(model, discount, iterations, engine='table', tolerance=None,
+                           schedule='synchronous', callback=None, V0=None, workers=None):
+    """Run sweeps k = 1 .. iterations - 1 starting from V0 (default 0).
+
+    Yields (k, V, best, residual, backups) after every sweep, with V and the
+    greedy action indices into ACTIONS indexed by state, residual the
+    max-norm change of V and backups the total number of state backups so
+    far. Stops early once the residual falls below tolerance.
+
+    schedule is 'synchronous' (Jacobi sweeps, with the table, grid or
+    parallel engine), 'gauss-seidel' (in-place sweeps in state order) or
+    'prioritized' (prioritized sweeping, each k draining the queue and
+    ending with a synchronous backup that gives the true residual, see
+    prioritized_sweeps).
+    callback, if given, is called with the metrics.FIELDS of every sweep.
+    workers is the number of processes of the parallel engine (see
+    parallel.synchronous_sweeps).
+    """
+    if schedule == 'synchronous':
+        sweeps = synchronous_sweeps(model, discount, iterations, engine, tolerance, V0, workers)
+    elif schedule == 'gauss-seidel':
+        sweeps = gauss_seidel_sweeps(model, discount, iterations, tolerance, V0)
+    elif schedule == 'prioritized':
+        sweeps = prioritized_sweeps(model, discount, iterations, tolerance, V0)
     else:
-        return livingReward
+        raise ValueError("Unknown schedule: {}".format(schedule))
+    if callback is not None:
+        sweeps = metrics.observe(sweeps, callback, lambda item: (item[0], item[3], item[4], item[2]))
+    return sweeps
+
+def synchronous_sweeps(model, discount, iterations, engine='table', tolerance=None, V0=None, workers=None):
+    # Jacobi sweeps: every backup reads the values of the previous sweep
+    if engine == 'parallel':
+        # Row blocks backed up by worker processes, see parallel.synchronous_sweeps
+        yield from parallel.synchronous_sweeps(model, discount, iterations, tolerance, V0, workers)
+        return
+    elif engine == 'table':
+        # V(s) indexed by state
+        V = np.zeros(len(model['cells']))
+        if V0 is not None:
+            V[:] = V0
+    elif engine == 'grid':
+        # V(s) as a rows x cols array, backed up with shifted-array operations
+        model = mdp.compile_stencil(model)
+        V = np.zeros((model['rows'], model['cols']))
+        if V0 is not None:
+            V[model['mask']] = V0
+    else:
+        raise ValueError("Unknown engine: {}".format(engine))
+
+    for k in range(1, iterations):
+        if engine == 'table':
+            V_new, best = backup(model, V, discount)
+            V_states, best_states = V_new, best
+        else:
+            V_new, best = backup_grid(model, V, discount)
+            V_states, best_states = V_new[model['mask']], best[model['mask']]
+        residual = mdp.max_residual(V_new, V)
+        V = V_new
+        yield k, V_states, best_states, residual, k * len(model['cells'])
+        if tolerance is not None and residual < tolerance:
+            return
+
+def gauss_seidel_sweeps(model, discount, iterations, tolerance=None, V0=None):
+    # In-place sweeps: every backup already sees the values updated earlier
+    # in the same sweep
+    backup_state = state_backup(model, discount)
+    V = [0.0] * len(model['cells']) if V0 is None else np.asarray(V0, dtype=float).tolist()
+    backups = 0
+    for k in range(1, iterations):
+        residual = 0.0
+        for s in range(len(V)):
+            value = backup_state(V, s)
+            residual = max(residual, abs(value - V[s]))
+            V[s] = value
+        backups += len(V)
+        V_states = np.array(V)
+        yield k, V_states, greedy_actions(model, V_states, discount), residual, backups
+        if tolerance is not None and residual < tolerance:
+            return
+
+def prioritized_sweeps(model, discount, iterations, tolerance=None, V0=None):
+    # Back up the state with the highest priority first. Backing up s by a
+    # change dV re-queues every predecessor p with the cheap priority
+    # P(s|p) * |dV| instead of a backup of p. Every k pops states until no
+    # priority exceeds tolerance (at most one pop per state without one) and
+    # ends with one synchronous backup of V (see backup), which gives the
+    # greedy actions, the true max Bellman error as residual and the exact
+    # errors the next k starts its queue from. backups counts the popped
+    # states plus the states of those synchronous backups
+    backup_state = state_backup(model, discount)
+    preds = mdp.weighted_predecessors(model)
+    theta = tolerance if tolerance is not None else 0.0
+    V = [0.0] * len(model['cells']) if V0 is None else np.asarray(V0, dtype=float).tolist()
+
+    V_states = np.array(V)
+    errors = np.abs(backup(model, V_states, discount)[0] - V_states)
+    backups = len(V)
+    for k in range(1, iterations):
+        queued = np.nonzero(errors > theta)[0]
+        priority = dict(zip(queued.tolist(), errors[queued].tolist()))
+        queue = [(-error, s) for s, error in priority.items()]
+        heapq.heapify(queue)
+
+        budget = len(V) if tolerance is None else float('inf')
+        while queue and budget > 0:
+            error, s = heapq.heappop(queue)
+            if priority.get(s) != -error:
+                continue  # Stale entry, s was re-queued or already backed up
+            del priority[s]
+            value = backup_state(V, s)
+            change = abs(value - V[s])
+            V[s] = value
+            backups += 1
+            budget -= 1
+            for p, prob in preds[s]:
+                estimate = prob * change
+                if estimate > theta and estimate > priority.get(p, 0.0):
+                    priority[p] = estimate
+                    heapq.heappush(queue, (-estimate, p))
+
+        V_states = np.array(V)
+        V_backup, best = backup(model, V_states, discount)
+        errors = np.abs(V_backup - V_states)
+        backups += len(V)
+        residual = float(errors.max()) if len(V) else 0.0
+        yield k, V_states, best, residual, backups
+        if residual == 0.0 or (tolerance is not None and residual < tolerance):
+            return
+
+def state_backup(model, discount):
+    # Scalar Bellman backup of a single state against a list of values,
+    # reading the same precomputed table as the vectorized engines
+    next_states = model['next_states'].tolist()
+    probs = model['probs'].tolist()
+    livingReward = model['livingReward']
+    terminal = model['terminal'].tolist()
+    rewards = model['terminal_rewards'].tolist()
+    def backup_state(V, s):
+        if terminal[s]:
+            return rewards[s]
+        max_value = float('-inf')
+        for a in ACTION_CODES:
+            value = 0.0
+            for prob, next_state in zip(probs, next_states[s][a]):
+                value += prob * (livingReward + discount * V[next_state])
+            if value > max_value:
+                max_value = value
+        return max_value
+    return backup_state
+
+def greedy_actions(model, V, discount):
+    return np.argmax(mdp.q_values(model, V, discount)[:, ACTION_CODES], axis=1)
+
+def backup(model, V, discount):
+    # One synchronous Bellman backup of every state, returns the new values
+    # and the index into ACTIONS of the greedy action of each state
+    terminal = model['terminal']
+    Q = mdp.q_values(model, V, discount)[:, ACTION_CODES]
+    best = np.argmax(Q, axis=1)
+    V_new = Q[np.arange(len(best)), best]
+    V_new[terminal] = model['terminal_rewards'][terminal]
+    return V_new, best
+
+def backup_grid(stencil, V, discount):
+    # Same as backup, on the rows x cols value grid; walls stay at zero
+    terminal = stencil['terminal_grid']
+    Q = mdp.grid_q_values(stencil, V, discount)[ACTION_CODES]
+    best = np.argmax(Q, axis=0)
+    V_new = np.take_along_axis(Q, best[np.newaxis], axis=0)[0]
+    V_new[terminal] = stencil['terminal_rewards_grid'][terminal]
+    V_new[~stencil['mask']] = 0.0
+    return V_new, best
+
+def greedy_policy(model, best):
+    policy = [ACTIONS[a] for a in best]
+    for s in np.nonzero(model['terminal'])[0]:
+        policy[s] = 'x'  # Terminal states have no policy
+    return policy
 
-def format_values(V, grid):
-    rows = len(grid)
-    cols = len(grid[0])
+def format_values(V, model):
+    index = model['index']
     formatted_rows = []
-    for i in range(rows):
+    for i in range(model['rows']):
         row_values = []
-        for j in range(cols):
-            cell = grid[i][j]
-            if cell == '#':
+        for j in range(model['cols']):
+            s = index[i, j]
+            if s < 0:
                 value_str = " ##### "
             else:
-                state = (i, j)
-                value = V[state]
-                value_str = f"{value:7.2f}"
+                value_str = f"{V[s]:7.2f}"
             row_values.append(value_str)
         formatted_row = "|{}|".format('||'.join(row_values))
         formatted_rows.append(formatted_row)
     return '\n'.join(formatted_rows)
 
-def format_policy(policy, grid):
-    rows = len(grid)
-    cols = len(grid[0])
+def format_policy(policy, model):
+    index = model['index']
     formatted_rows = []
-    for i in range(rows):
+    for i in range(model['rows']):
         row_values = []
-        for j in range(cols):
-            cell = grid[i][j]
-            if cell == '#':
+        for j in range(model['cols']):
+            s = index[i, j]
+            if s < 0:
                 value_str = " # "
             else:
-                state = (i, j)
-                action = policy.get(state, '')
-                value_str = f" {action} "
+                value_str = f" {policy[s]} "
             row_values.append(value_str)
         formatted_row = "|{}|".format('||'.join(row_values))
         formatted_rows.append(formatted_row)
@@ -168,5 +268,8 @@ def format_policy(policy, grid):
 
 if __name__ == "__main__":
     test_case_id = int(sys.argv[1])
+    engine = sys.argv[2] if len(sys.argv) > 2 else 'table'
+    workers = int(sys.argv[3]) if len(sys.argv) > 3 else None
     problem_id = 3
-    grader.grade(problem_id, test_case_id, value_iteration, parse.read_grid_mdp_problem_p3)
+    grader.grade(problem_id, test_case_id, lambda problem: value_iteration(problem, engine, workers=workers),
+                 cache.read_grid_mdp_problem_p3)
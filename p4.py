@@ -28,141 +28,404 @@ Implementation Details:
 - The learning rate (alpha) decays over time to ensure convergence.
 - We stop the iteration when the policy becomes stable over multiple episodes (without comparing against the optimal policy).
 - We run the learning algorithm 10 times (with different random seeds) and output how often the optimal policy is found.
+- The runs are independent and dispatched across a process pool; each run gets its own seed derived from a master seed.
 
 Results:
-- After running the learning algorithm 10 times, we found that the optimal policy was obtained in 9 out of 10 runs.
+- A learned policy counts as optimal when it matches OPTIMAL_POLICY on every non-terminal state.
+- With master seed 42, the optimal policy was found in 0 of 10 runs and 1 of 100 runs. The top row, (1,0) and (2,0) are always learned correctly; the other lower states are nearly tied (at (2,1) E beats W by 0.0005) and the stability stopping rule ends learning before they are resolved.
+- Replay planning (planning_steps, Dyna-Q) is judged by measures that do not depend on the stability rule. Over 20 runs with master seed 42, the greedy policy first equalled OPTIMAL_POLICY after a median of 489 real steps without planning, 248 with 5 planning steps and 245 with 20, and the final max |Q - Q*| fell from 0.42 to 0.18 and 0.16. Steps to stability rise instead (6.8k, 8.7k, 10.5k), as extra updates flip the nearly tied greedy actions more often.
 
 How to Run:
 - Make sure you have Python 3 installed.
-- Run the script using the command: `python p4.py`
+- Run the script using the command: `python p4.py [num_runs] [master_seed] [workers] [planning_steps]`
 - The script will output the learned policy and the number of times the optimal policy was found.
 
 Note:
-- Since we are not setting a fixed seed, results may vary on different runs.
+- Without a master seed a fresh one is drawn and printed, so results may vary on different runs but any run can be reproduced by passing the printed master seed.
 """
 
 import random
+import sys
+import time
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
+import mdp
+
+# Define the MDP parameters
+GRID = [
+    ['_', '_', '_', '1'],
+    ['_', '#', '_', '-1'],
+    ['S', '_', '_', '_']
+]
+GAMMA = 0.9
+NOISE = 0.2  # Intended action with probability 0.8
+LIVING_REWARD = -0.01
+
+# Define actions
+ACTIONS = ['N', 'E', 'S', 'W']
+ACTION_EFFECTS = {
+    'N': (-1, 0),
+    'E': (0, 1),
+    'S': (1, 0),
+    'W': (0, -1)
+}
+
+# Optimal policy for comparison, from value iteration on this MDP (rewards
+# received on entering a state, terminals worth 0 afterwards). The policy
+# from the slide (S, W and S moves in the lower rows) is not optimal here.
+# (2,1) E beats W by 0.0005 and (2,3) W beats S by 0.02
+OPTIMAL_POLICY = {
+    (0,0): 'E', (0,1): 'E', (0,2): 'E', (0,3): 'x',
+    (1,0): 'N',          (1,2): 'N', (1,3): 'x',
+    (2,0): 'N', (2,1): 'E', (2,2): 'N', (2,3): 'W'
+}
+
+def main(num_runs=10, master_seed=None, workers=None, planning_steps=0):
+    # Derive one independent seed per run from the master seed, so any set
+    # of runs can be reproduced from the master seed alone
+    seed_sequence = np.random.SeedSequence(master_seed)
+    seeds = [int(seed) for seed in seed_sequence.generate_state(num_runs)]
+    print(f"Master seed: {seed_sequence.entropy}")
+
+    # Runs are independent, dispatch them across a process pool; map
+    # returns the results in run order
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(partial(q_learning_run, planning_steps=planning_steps), seeds))
 
-def main():
-    # Define the MDP parameters
-    grid = [
-        ['_', '_', '_', '1'],
-        ['_', '#', '_', '-1'],
-        ['S', '_', '_', '_']
-    ]
-    gamma = 0.9
-    noise = 0.2  # Intended action with probability 0.8
-    living_reward = -0.01
-
-    # Define actions
-    actions = ['N', 'E', 'S', 'W']
-    action_effects = {
-        'N': (-1, 0),
-        'E': (0, 1),
-        'S': (1, 0),
-        'W': (0, -1)
-    }
-
-    # Number of runs to evaluate the policy
-    num_runs = 10
     optimal_policy_found = 0
+    for run, result in enumerate(results):
+        if result['optimal']:
+            optimal_policy_found += 1
 
-    # Optimal policy for comparison (from the slide)
-    optimal_policy = {
-        (0,0): 'E', (0,1): 'E', (0,2): 'E', (0,3): 'x',
-        (1,0): 'S',          (1,2): 'S', (1,3): 'x',
-        (2,0): 'W', (2,1): 'S', (2,2): 'S', (2,3): 'S'
-    }
+        print(f"Run {run+1} (seed {result['seed']}, {result['episodes']} episodes, "
+              f"{result['steps']} steps, optimal after {result['steps_to_optimal']} steps, "
+              f"max |Q - Q*| {result['q_error']:.3f}, {result['time']:.2f}s):")
+        print_policy(result['policy'], GRID)
+        print('---')
 
-    for run in range(num_runs):
-        # Initialize Q-values
-        Q = {}
-        for i in range(len(grid)):
-            for j in range(len(grid[0])):
-                if grid[i][j] != '#' and grid[i][j] != '1' and grid[i][j] != '-1':
-                    for a in actions:
-                        Q[((i, j), a)] = 0.0
-
-        # Parameters for epsilon-greedy policy and learning rate
-        epsilon = 1.0           # Initial exploration rate
-        epsilon_decay = 0.995   # Decay rate for exploration
-        min_epsilon = 0.01      # Minimum exploration rate
-        alpha = 1.0             # Initial learning rate
-        alpha_decay = 0.995     # Decay rate for learning rate
-        min_alpha = 0.01        # Minimum learning rate
-
-        max_episodes = 10000
-        max_steps_per_episode = 100
-
-        # To check for policy stability
-        policy_stable_threshold = 100  # Number of episodes to check for stability
-        policy_stable = False
-        stable_episode_count = 0
-        previous_policy = {}
-
-        for episode in range(max_episodes):
-            state = get_start_state(grid)
-            for step in range(max_steps_per_episode):
-                # Choose action using epsilon-greedy policy
-                if random.uniform(0,1) < epsilon:
-                    action = random.choice(actions)
-                else:
-                    action = get_best_action(Q, state, actions)
-
-                # Take action and observe next state and reward
-                next_state, reward, done = take_action(state, action, grid, action_effects, noise, living_reward)
-
-                # Update Q-value
-                sample = reward + gamma * max([Q.get((next_state, a), 0) for a in actions])
-                Q[(state, action)] = (1 - alpha) * Q.get((state, action), 0) + alpha * sample
-
-                state = next_state
-
-                if done:
-                    break
-
-            # Decay epsilon and alpha
-            epsilon = max(min_epsilon, epsilon * epsilon_decay)
-            alpha = max(min_alpha, alpha * alpha_decay)
-
-            # Extract the current policy
-            current_policy = {}
-            for i in range(len(grid)):
-                for j in range(len(grid[0])):
-                    if grid[i][j] != '#' and grid[i][j] != '1' and grid[i][j] != '-1':
-                        state = (i,j)
-                        action = get_best_action(Q, state, actions)
-                        if grid[i][j] in ['1', '-1']:
-                            current_policy[state] = 'x'  # Terminal states
-                        else:
-                            current_policy[state] = action
-
-            # Check if the policy is stable
-            if current_policy == previous_policy:
-                stable_episode_count += 1
+    print(f"Optimal policy was found in {optimal_policy_found}/{num_runs} runs.")
+    return results
+
+def q_learning_run(seed, planning_steps=0, buffer_capacity=10000, eviction='fifo'):
+    """One independent Q-learning run on GRID with its own random generator.
+
+    With planning_steps > 0 every real transition is also stored in a replay
+    buffer of buffer_capacity transitions (Dyna-Q with a sample model), and
+    planning_steps transitions drawn from it are replayed as extra Q updates
+    after each real step. Once the buffer is full, eviction 'fifo' overwrites
+    the oldest transition and 'random' a random one.
+
+    Returns the learned policy, the number of episodes it took (until the
+    policy was stable or max_episodes), the number of real environment
+    steps, the wall time, whether it became stable and whether it matches
+    OPTIMAL_POLICY. Two measures of sample efficiency do not depend on the
+    stability rule: steps_to_optimal, the real steps taken when the greedy
+    policy first equalled OPTIMAL_POLICY (None if it never did), and
+    q_error, the final max |Q - Q*| over the non-terminal states.
+    """
+    start_time = time.perf_counter()
+    rng = random.Random(seed)
+    grid = GRID
+    gamma = GAMMA
+    noise = NOISE
+    living_reward = LIVING_REWARD
+    actions = ACTIONS
+    action_codes = list(range(len(actions)))
+    action_effects = ACTION_EFFECTS
+
+    # Initialize Q-values: Q[i, j, a] for action code a (index into ACTIONS);
+    # walls are never visited and terminal states keep Q = 0
+    Q = np.zeros((len(grid), len(grid[0]), len(actions)))
+
+    # Parameters for epsilon-greedy policy and learning rate
+    epsilon = 1.0           # Initial exploration rate
+    epsilon_decay = 0.995   # Decay rate for exploration
+    min_epsilon = 0.01      # Minimum exploration rate
+    alpha = 1.0             # Initial learning rate
+    alpha_decay = 0.995     # Decay rate for learning rate
+    min_alpha = 0.01        # Minimum learning rate
+
+    max_episodes = 10000
+    max_steps_per_episode = 100
+
+    # Greedy action code of every non-terminal state, kept up to date as Q
+    # changes instead of being re-extracted after every episode
+    greedy = np.full((len(grid), len(grid[0])), -1, dtype=np.int64)
+    for i in range(len(grid)):
+        for j in range(len(grid[0])):
+            if grid[i][j] != '#' and grid[i][j] != '1' and grid[i][j] != '-1':
+                greedy[i, j] = get_best_action(Q, (i, j), rng)
+
+    # To check for policy stability
+    policy_stable_threshold = 100  # Number of episodes to check for stability
+    policy_stable = False
+    last_policy_change = 0  # Episode in which the greedy policy last changed
+
+    # Non-terminal states whose greedy action differs from OPTIMAL_POLICY
+    target = np.full(greedy.shape, -1, dtype=np.int64)
+    for (i, j), action in OPTIMAL_POLICY.items():
+        if action != 'x':
+            target[i, j] = actions.index(action)
+    wrong = {(i, j) for i, j in zip(*np.nonzero(target >= 0)) if greedy[i, j] != target[i, j]}
+    steps_to_optimal = None if wrong else 0
+    def track(state):
+        if target[state] >= 0:
+            if greedy[state] == target[state]:
+                wrong.discard(state)
             else:
-                stable_episode_count = 0  # Reset if policy has changed
+                wrong.add(state)
 
-            previous_policy = current_policy.copy()
+    buffer = make_replay_buffer(buffer_capacity) if planning_steps > 0 else None
+    total_steps = 0
 
-            if stable_episode_count >= policy_stable_threshold:
-                # Policy has been stable for enough episodes
-                policy_stable = True
-                break  # Exit learning
+    for episode in range(max_episodes):
+        state = get_start_state(grid)
+        for step in range(max_steps_per_episode):
+            # Choose action using epsilon-greedy policy
+            if rng.uniform(0,1) < epsilon:
+                a = rng.choice(action_codes)
+            else:
+                a = greedy[state]
+
+            # Take action and observe next state and reward
+            next_state, reward, done = take_action(state, actions[a], grid, action_effects, noise, living_reward, rng)
+
+            # Update Q-value
+            if update_q(Q, greedy, state, a, reward, next_state, alpha, gamma, rng):
+                last_policy_change = episode
+                track(state)
+            total_steps += 1
+
+            # Plan: replay stored transitions as if they were experienced again
+            if buffer is not None:
+                add_transition(buffer, state, a, reward, next_state, eviction, rng)
+                for _ in range(planning_steps):
+                    replayed = sample_transition(buffer, rng)
+                    if update_q(Q, greedy, *replayed, alpha, gamma, rng):
+                        last_policy_change = episode
+                        track(replayed[0])
+
+            if steps_to_optimal is None and not wrong:
+                steps_to_optimal = total_steps
+
+            state = next_state
+
+            if done:
+                break
+
+        # Decay epsilon and alpha
+        epsilon = max(min_epsilon, epsilon * epsilon_decay)
+        alpha = max(min_alpha, alpha * alpha_decay)
+
+        # Check if the policy is stable
+        if episode - last_policy_change >= policy_stable_threshold:
+            # Policy has been stable for enough episodes
+            policy_stable = True
+            break  # Exit learning
+
+    # After learning, extract the policy
+    learned_policy = {}
+    for i in range(len(grid)):
+        for j in range(len(grid[0])):
+            if greedy[i, j] >= 0:
+                learned_policy[(i, j)] = actions[greedy[i, j]]
+
+    Q_star = optimal_q_values()
+    return {
+        'seed': seed,
+        'policy': learned_policy,
+        'episodes': episode + 1,
+        'steps': total_steps,
+        'steps_to_optimal': steps_to_optimal,
+        'q_error': float(np.max(np.abs(Q - Q_star)[greedy >= 0])),
+        'time': time.perf_counter() - start_time,
+        'stable': policy_stable,
+        # Compare learned policy with the optimal policy
+        'optimal': compare_policies(learned_policy, OPTIMAL_POLICY),
+    }
 
-        # After learning, extract the policy
-        learned_policy = current_policy
+def optimal_q_values():
+    """Q* of GRID under the dynamics of take_action, by value iteration.
+
+    Rewards are received on entering a state and terminals are worth 0
+    afterwards. Returns a rows x cols x 4 array laid out like the Q of
+    q_learning_run, zero for walls and terminals.
+    """
+    # ACTIONS and mdp.DIRECTIONS share the order N, E, S, W
+    layout = mdp.compile_grid(GRID)
+    terminal = layout['terminal']
+    rewards = np.where(terminal, layout['terminal_rewards'], LIVING_REWARD)
+    d = np.arange(len(ACTIONS))
+    next_states = layout['neighbours'][:, [d, (d + 1) % 4, (d - 1) % 4]]
+    probs = [1 - NOISE, NOISE / 2, NOISE / 2]
+
+    Q = np.zeros((len(layout['cells']), len(ACTIONS)))
+    while True:
+        V = np.where(terminal, 0.0, Q.max(axis=1))
+        Q_new = sum(p * (rewards[next_states[:, k]] + GAMMA * V[next_states[:, k]]) for k, p in enumerate(probs))
+        Q_new[terminal] = 0.0
+        if np.max(np.abs(Q_new - Q)) < 1e-12:
+            break
+        Q = Q_new
+    Q_star = np.zeros((layout['rows'], layout['cols'], len(ACTIONS)))
+    Q_star[layout['index'] >= 0] = Q_new
+    return Q_star
+
+def q_learning_population(num_learners, seed=None, epsilon_decay=0.995, alpha_decay=0.995,
+                          policy_stable_threshold=100, max_episodes=10000, max_steps_per_episode=100,
+                          grid=GRID):
+    """Run a population of independent Q-learners on a grid in lockstep.
+
+    The learners' states, Q-tables, greedy actions and epsilon/alpha
+    schedules are stacked arrays, and every step advances all learners that
+    are still learning at once, with the same dynamics as take_action and
+    the same incremental stability check as q_learning_run. epsilon_decay,
+    alpha_decay and policy_stable_threshold are scalars or one value per
+    learner, for hyperparameter sweeps. Any grid with a start state and
+    numeric terminals can replace GRID. Returns the learned policies and,
+    per learner, the episodes and environment steps used, whether the
+    policy became stable and whether it matches OPTIMAL_POLICY.
+    """
+    rng = np.random.default_rng(seed)
+    gamma = GAMMA
+    noise = NOISE
+    living_reward = LIVING_REWARD
+    min_epsilon = 0.01
+    min_alpha = 0.01
+
+    # Integer-indexed states; ACTIONS and mdp.DIRECTIONS share the order
+    # N, E, S, W, so action codes index the neighbour table directly
+    layout = mdp.compile_grid(grid)
+    neighbours = layout['neighbours']
+    terminal = layout['terminal']
+    terminal_rewards = layout['terminal_rewards']
+    start_state = layout['index'][get_start_state(grid)]
+    num_states = len(layout['cells'])
+
+    learners = np.arange(num_learners)
+    epsilon_decay = np.broadcast_to(np.asarray(epsilon_decay, dtype=float), (num_learners,))
+    alpha_decay = np.broadcast_to(np.asarray(alpha_decay, dtype=float), (num_learners,))
+    policy_stable_threshold = np.broadcast_to(np.asarray(policy_stable_threshold), (num_learners,))
+
+    Q = np.zeros((num_learners, num_states, len(ACTIONS)))
+    greedy = rng.integers(len(ACTIONS), size=(num_learners, num_states))
+    epsilon = np.ones(num_learners)
+    alpha = np.ones(num_learners)
+    state = np.full(num_learners, start_state)
+    step = np.zeros(num_learners, dtype=np.int64)
+    total_steps = np.zeros(num_learners, dtype=np.int64)
+    episode = np.zeros(num_learners, dtype=np.int64)
+    last_policy_change = np.zeros(num_learners, dtype=np.int64)
+    learning = np.ones(num_learners, dtype=bool)
+    stable = np.zeros(num_learners, dtype=bool)
+
+    while learning.any():
+        l = learners[learning]
+        s = state[l]
+        n = len(l)
+
+        # Choose actions epsilon-greedily
+        explore = rng.random(n) < epsilon[l]
+        a = np.where(explore, rng.integers(len(ACTIONS), size=n), greedy[l, s])
+
+        # Intended direction with probability 1 - noise, otherwise one of
+        # the two perpendicular directions
+        u = rng.random(n)
+        slip = np.where(u < 1 - noise, 0, np.where(u < 1 - noise / 2, 1, -1))
+        next_s = neighbours[s, (a + slip) % 4]
+        done = terminal[next_s]
+        reward = np.where(done, terminal_rewards[next_s], living_reward)
+
+        # Update Q-values
+        sample = reward + gamma * Q[l, next_s].max(axis=1)
+        Q[l, s, a] = (1 - alpha[l]) * Q[l, s, a] + alpha[l] * sample
+
+        # Re-pick the greedy action, at random among ties, only where the
+        # current one is no longer among the best
+        q = Q[l, s]
+        best = q.max(axis=1)
+        changed = q[np.arange(n), greedy[l, s]] != best
+        if changed.any():
+            ties = q[changed] == best[changed, np.newaxis]
+            greedy[l[changed], s[changed]] = np.argmax(ties * rng.random(ties.shape), axis=1)
+            last_policy_change[l[changed]] = episode[l[changed]]
+
+        state[l] = next_s
+        step[l] += 1
+        total_steps[l] += 1
+
+        # Finish the episodes that reached a terminal or the step limit
+        ended = l[done | (step[l] >= max_steps_per_episode)]
+        if len(ended):
+            epsilon[ended] = np.maximum(min_epsilon, epsilon[ended] * epsilon_decay[ended])
+            alpha[ended] = np.maximum(min_alpha, alpha[ended] * alpha_decay[ended])
+            stable[ended] = episode[ended] - last_policy_change[ended] >= policy_stable_threshold[ended]
+            episode[ended] += 1
+            learning[ended] = ~stable[ended] & (episode[ended] < max_episodes)
+            state[ended] = start_state
+            step[ended] = 0
+
+    policies = []
+    for k in learners:
+        policy = {}
+        for s, cell in enumerate(layout['cells']):
+            if not terminal[s]:
+                policy[cell] = ACTIONS[greedy[k, s]]
+        policies.append(policy)
+
+    return {
+        'policies': policies,
+        'episodes': episode,
+        'steps': total_steps,
+        'stable': stable,
+        'optimal': np.array([compare_policies(policy, OPTIMAL_POLICY) for policy in policies]),
+    }
 
-        # Compare learned policy with the optimal policy
-        if compare_policies(learned_policy, optimal_policy):
-            optimal_policy_found += 1
+def update_q(Q, greedy, state, a, reward, next_state, alpha, gamma, rng=random):
+    # One Q-learning update; returns whether the greedy action of state
+    # changed. Only this state's Q-values change, so its greedy action is
+    # kept as long as it is still one of the best
+    i, j = state
+    sample = reward + gamma * Q[next_state].max()
+    Q[i, j, a] = (1 - alpha) * Q[i, j, a] + alpha * sample
+    if Q[i, j, greedy[i, j]] != Q[i, j].max():
+        greedy[i, j] = get_best_action(Q, state, rng)
+        return True
+    return False
 
-        print(f"Run {run+1}:")
-        print_policy(learned_policy, grid)
-        print('---')
+def make_replay_buffer(capacity):
+    # Fixed-capacity ring buffer of (state, action, reward, next_state)
+    return {
+        'states': np.zeros((capacity, 2), dtype=np.int64),
+        'actions': np.zeros(capacity, dtype=np.int64),
+        'rewards': np.zeros(capacity),
+        'next_states': np.zeros((capacity, 2), dtype=np.int64),
+        'size': 0,
+        'next': 0,
+    }
 
-    print(f"Optimal policy was found in {optimal_policy_found}/{num_runs} runs.")
+def add_transition(buffer, state, a, reward, next_state, eviction='fifo', rng=random):
+    capacity = len(buffer['actions'])
+    if buffer['size'] < capacity:
+        slot = buffer['size']
+        buffer['size'] += 1
+    elif eviction == 'fifo':
+        slot = buffer['next']
+        buffer['next'] = (slot + 1) % capacity
+    elif eviction == 'random':
+        slot = rng.randrange(capacity)
+    else:
+        raise ValueError("Unknown eviction: {}".format(eviction))
+    buffer['states'][slot] = state
+    buffer['actions'][slot] = a
+    buffer['rewards'][slot] = reward
+    buffer['next_states'][slot] = next_state
+
+def sample_transition(buffer, rng=random):
+    slot = rng.randrange(buffer['size'])
+    return (tuple(buffer['states'][slot]), buffer['actions'][slot],
+            buffer['rewards'][slot], tuple(buffer['next_states'][slot]))
 
 def get_start_state(grid):
     for i in range(len(grid)):
@@ -171,13 +434,13 @@ def get_start_state(grid):
                 return (i, j)
     raise Exception("Start state not found.")
 
-def get_best_action(Q, state, actions):
-    q_values = [Q.get((state, a), 0) for a in actions]
-    max_q = max(q_values)
-    best_actions = [a for a, q in zip(actions, q_values) if q == max_q]
-    return random.choice(best_actions)
+def get_best_action(Q, state, rng=random):
+    # Code of a greedy action in state, ties broken at random
+    q_values = Q[state]
+    best_actions = np.flatnonzero(q_values == q_values.max())
+    return int(rng.choice(best_actions))
 
-def take_action(state, action, grid, action_effects, noise, living_reward):
+def take_action(state, action, grid, action_effects, noise, living_reward, rng=random):
     # With probability (1 - noise), take intended action
     # With probability noise, take one of the two perpendicular actions (split equally)
     possible_actions = [action]
@@ -185,7 +448,7 @@ def take_action(state, action, grid, action_effects, noise, living_reward):
     possible_actions.extend(perpendicular_actions)
     probs = [1 - noise] + [noise / 2] * 2
 
-    chosen_action = random.choices(possible_actions, weights=probs)[0]
+    chosen_action = rng.choices(possible_actions, weights=probs)[0]
     effect = action_effects[chosen_action]
     next_state = (state[0] + effect[0], state[1] + effect[1])
 
@@ -227,8 +490,10 @@ def is_valid_state(state, grid):
     return False
 
 def compare_policies(policy1, policy2):
-    for state in policy2:
-        if policy1.get(state) != policy2.get(state):
+    # Terminal states ('x' in policy2) have no action, learned policies do
+    # not contain them
+    for state, action in policy2.items():
+        if action != 'x' and policy1.get(state) != action:
             return False
     return True
 
@@ -255,4 +520,9 @@ def print_policy(policy, grid):
         print('| ' + row_str + ' |')
 
 if __name__ == "__main__":
-    main()
+    # python p4.py [num_runs] [master_seed] [workers]
+    num_runs = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    master_seed = int(sys.argv[2]) if len(sys.argv) > 2 else None
+    workers = int(sys.argv[3]) if len(sys.argv) > 3 else None
+    planning_steps = int(sys.argv[4]) if len(sys.argv) > 4 else 0
+    main(num_runs, master_seed, workers, planning_steps)
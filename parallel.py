@@ -0,0 +1,127 @@
+import multiprocessing, os, threading
+from multiprocessing import shared_memory
+import numpy as np
+import mdp, p3
+
+# Without an explicit number of workers, every block backs up at least this
+# many states, so small grids do not start a process per CPU
+MIN_BLOCK_STATES = 10000
+
+def partition_rows(model, workers):
+    """Split the grid into contiguous row blocks of roughly equal state counts.
+
+    States index the non-wall cells in row-major order (see
+    mdp.compile_grid), so a block of rows owns a contiguous range of states.
+    Returns the (first, end) state range of every non-empty block.
+    """
+    per_row = np.count_nonzero(model['index'] >= 0, axis=1)
+    row_starts = np.concatenate([[0], np.cumsum(per_row)])
+    num_states = int(row_starts[-1])
+    targets = np.arange(workers + 1) * num_states / workers
+    bounds = row_starts[np.searchsorted(row_starts, targets)].tolist()
+    return [(first, end) for first, end in zip(bounds, bounds[1:]) if end > first]
+
+def sweep_worker(first, end, next_states, terminal, terminal_rewards, params, discount,
+                 names, num_states, barriers, block, num_blocks):
+    # Backs up the states first .. end - 1 of every sweep. The block reads the
+    # previous sweep from the shared V (its halo rows included, as written by
+    # the neighbouring blocks before the last barrier) and writes its own
+    # slice of the other buffer, so nothing is copied between processes
+    buffers = [shared_memory.SharedMemory(name=name) for name in names]
+    values = np.ndarray((2, num_states), dtype=float, buffer=buffers[0].buf)
+    best = np.ndarray(num_states, dtype=np.int64, buffer=buffers[1].buf)
+    residuals = np.ndarray(num_blocks, dtype=float, buffer=buffers[2].buf)
+    stop = np.ndarray(1, dtype=bool, buffer=buffers[3].buf)
+    start, done = barriers
+    V, parity = None, 0
+    try:
+        while True:
+            start.wait()
+            if stop[0]:
+                break
+            V = values[parity]
+            Q = mdp.q_values(params, V, discount, next_states)
+            block_best = np.argmax(Q, axis=1)
+            V_new = Q[np.arange(len(block_best)), block_best]
+            V_new[terminal] = terminal_rewards
+            residuals[block] = float(np.max(np.abs(V_new - V[first:end])))
+            values[1 - parity, first:end] = V_new
+            best[first:end] = block_best
+            parity = 1 - parity
+            done.wait()
+    except Exception:
+        # Release the main process and the other workers instead of
+        # leaving them waiting on a barrier this block will never reach
+        start.abort()
+        done.abort()
+        raise
+    finally:
+        del values, best, residuals, stop, V
+        for buffer in buffers:
+            buffer.close()
+
+def synchronous_sweeps(model, discount, iterations, tolerance=None, V0=None, workers=None):
+    """Jacobi value iteration with the grid split across worker processes.
+
+    Yields the same (k, V, best, residual, backups) as
+    p3.synchronous_sweeps, with bit-identical values. The row blocks of
+    partition_rows are backed up by one persistent process each; V is double
+    buffered in shared memory and two barriers per sweep separate reading
+    the previous values (halo rows included) from writing the new ones.
+    workers defaults to the number of CPUs, capped so that every block has
+    at least MIN_BLOCK_STATES states.
+    """
+    num_states = len(model['cells'])
+    if workers is None:
+        workers = max(1, min(os.cpu_count() or 1, num_states // MIN_BLOCK_STATES))
+    blocks = partition_rows(model, workers) if num_states else []
+    ctx = multiprocessing.get_context()
+    # Terminal values are pinned, the next states of every block are sent
+    # once to its worker and the greedy actions are indices into p3.ACTIONS
+    next_states = model['next_states'][:, p3.ACTION_CODES]
+    terminal = model['terminal']
+    terminal_rewards = model['terminal_rewards']
+
+    sizes = [2 * max(num_states, 1) * 8, max(num_states, 1) * 8, max(len(blocks), 1) * 8, 1]
+    buffers = [shared_memory.SharedMemory(create=True, size=size) for size in sizes]
+    values = np.ndarray((2, num_states), dtype=float, buffer=buffers[0].buf)
+    best = np.ndarray(num_states, dtype=np.int64, buffer=buffers[1].buf)
+    residuals = np.ndarray(len(blocks), dtype=float, buffer=buffers[2].buf)
+    stop = np.ndarray(1, dtype=bool, buffer=buffers[3].buf)
+    values[0] = 0.0 if V0 is None else V0
+    stop[0] = False
+
+    barriers = (ctx.Barrier(len(blocks) + 1), ctx.Barrier(len(blocks) + 1))
+    processes = []
+    try:
+        for b, (first, end) in enumerate(blocks):
+            block_terminal = terminal[first:end]
+            process = ctx.Process(target=sweep_worker, args=(
+                first, end, next_states[first:end], block_terminal, terminal_rewards[first:end][block_terminal],
+                {'probs': model['probs'], 'livingReward': model['livingReward']}, discount, [buffer.name for buffer in buffers],
+                num_states, barriers, b, len(blocks)))
+            process.start()
+            processes.append(process)
+
+        parity = 0
+        for k in range(1, iterations):
+            barriers[0].wait()
+            barriers[1].wait()
+            residual = float(residuals.max()) if len(blocks) else 0.0
+            parity = 1 - parity
+            yield k, values[parity].copy(), best.copy(), residual, k * num_states
+            if tolerance is not None and residual < tolerance:
+                return
+    finally:
+        stop[0] = True
+        try:
+            barriers[0].wait(timeout=0 if len(processes) < len(blocks) else None)
+        except threading.BrokenBarrierError:
+            for process in processes:
+                process.terminate()
+        for process in processes:
+            process.join()
+        del values, best, residuals, stop
+        for buffer in buffers:
+            buffer.close()
+            buffer.unlink()
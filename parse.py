@@ -1,131 +1,115 @@
-def read_grid_mdp_problem_p1(file_path):
-    # Initialize variables
-    seed = None
-    noise = None
-    livingReward = None
-    grid = []
-    policy = []
+import array
+import numpy as np
+
+# Scalar parameters and how to convert their values
+KEYS = {
+    'seed': int,
+    'discount': float,
+    'noise': float,
+    'livingReward': float,
+    'iterations': int,
+}
+# Sections whose following lines are rows of whitespace separated tokens
+SECTIONS = ['grid', 'policy']
+
+def read_grid_mdp_problem(file_path, encode=False):
+    """Parse a problem file in a single pass over its lines.
+
+    Recognises every key of the p1, p2 and p3 problem files. A grid or policy
+    section runs until the next key line; blank lines and lines outside a
+    section (e.g. '#' comments) are skipped. Only the keys present in the
+    file are set. With encode=True the grid and policy are returned as
+    encoded tables (see encode_table) built directly while reading, instead
+    of lists of lists of strings.
+    """
+    problem = {}
+    section = None
+    table = None
     with open(file_path, 'r') as f:
-        lines = f.readlines()
-    i = 0
-    while i < len(lines):
-        line = lines[i].strip()
-        if line.startswith('seed:'):
-            seed = int(line.split(':')[1].strip())
-            i += 1
-        elif line.startswith('noise:'):
-            noise = float(line.split(':')[1].strip())
-            i += 1
-        elif line.startswith('livingReward:'):
-            livingReward = float(line.split(':')[1].strip())
-            i += 1
-        elif line.startswith('grid:'):
-            i += 1  # Skip 'grid:'
-            while i < len(lines):
-                line = lines[i].strip()
-                if not line or line.startswith('policy:'):
-                    break
-                tokens = line.split()
-                grid.append(tokens)
-                i += 1
-        elif line.startswith('policy:'):
-            i += 1  # Skip 'policy:'
-            while i < len(lines):
-                line = lines[i].strip()
-                if not line:
-                    break
-                tokens = line.split()
-                policy.append(tokens)
-                i += 1
-        else:
-            i += 1  # Skip unknown lines
-    # Build the problem object
-    problem = {
-        'seed': seed,
-        'noise': noise,
-        'livingReward': livingReward,
-        'grid': grid,
-        'policy': policy
-    }
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            key, sep, value = line.partition(':')
+            if sep:
+                section = None
+                if key in KEYS:
+                    problem[key] = KEYS[key](value.strip())
+                elif key in SECTIONS:
+                    section = key
+                    table = new_table() if encode else []
+                    problem[key] = table
+                continue
+            if section is None:
+                continue  # Comments and unknown lines
+            tokens = line.split()
+            if encode:
+                add_row(table, tokens)
+            else:
+                table.append(tokens)
+    if encode:
+        for key in SECTIONS:
+            if key in problem:
+                problem[key] = build_table(problem[key])
     return problem
 
-def read_grid_mdp_problem_p2(file_path):
-    problem = {}
-    with open(file_path, 'r') as file:
-        lines = file.readlines()
-    
-    # Initialize variables
-    grid = []
-    policy = []
-    reading_grid = False
-    reading_policy = False
+def new_table():
+    # Accumulates rows of tokens as int32 codes into a token table
+    return {'tokens': {}, 'codes': array.array('i'), 'rows': 0, 'cols': None}
 
-    for line in lines:
-        line = line.strip()
-        if line.startswith('discount:'):
-            problem['discount'] = float(line.split(':')[1].strip())
-        elif line.startswith('noise:'):
-            problem['noise'] = float(line.split(':')[1].strip())
-        elif line.startswith('livingReward:'):
-            problem['livingReward'] = float(line.split(':')[1].strip())
-        elif line.startswith('iterations:'):
-            problem['iterations'] = int(line.split(':')[1].strip())
-        elif line.startswith('grid:'):
-            reading_grid = True
-            reading_policy = False
-            continue
-        elif line.startswith('policy:'):
-            reading_grid = False
-            reading_policy = True
-            continue
-        elif line == '':
-            continue
-        else:
-            if reading_grid:
-                grid_row = line.strip().split()
-                grid.append(grid_row)
-            elif reading_policy:
-                policy_row = line.strip().split()
-                policy.append(policy_row)
-    
-    problem['grid'] = grid
-    problem['policy'] = policy
-    return problem
+def add_row(table, tokens):
+    if table['cols'] is None:
+        table['cols'] = len(tokens)
+    elif len(tokens) != table['cols']:
+        raise ValueError("Row {} has {} cells, expected {}".format(table['rows'], len(tokens), table['cols']))
+    codes = table['tokens']
+    for token in dict.fromkeys(tokens):
+        if token not in codes:
+            codes[token] = len(codes)
+    table['codes'].extend(map(codes.__getitem__, tokens))
+    table['rows'] += 1
 
+def build_table(table):
+    codes = np.frombuffer(table['codes'], dtype=np.int32) if table['rows'] else np.zeros(0, dtype=np.int32)
+    return {
+        'tokens': list(table['tokens']),
+        'codes': codes.reshape(table['rows'], table['cols'] or 0),
+    }
 
-def read_grid_mdp_problem_p3(file_path):
-    problem = {}
-    with open(file_path, 'r') as f:
-        lines = f.readlines()
-    
-    # Remove comments and empty lines
-    lines = [line.strip() for line in lines if line.strip() and not line.strip().startswith('#')]
-    
-    # Parse parameters
-    i = 0
-    while i < len(lines):
-        line = lines[i]
-        if line.startswith('discount:'):
-            problem['discount'] = float(line.split(':')[1].strip())
-        elif line.startswith('noise:'):
-            problem['noise'] = float(line.split(':')[1].strip())
-        elif line.startswith('livingReward:'):
-            problem['livingReward'] = float(line.split(':')[1].strip())
-        elif line.startswith('iterations:'):
-            problem['iterations'] = int(line.split(':')[1].strip())
-        elif line.startswith('grid:'):
-            # Read the grid lines
-            grid = []
-            i += 1
-            while i < len(lines):
-                grid_line = lines[i].strip()
-                if grid_line:
-                    # Split the grid line into cells
-                    cells = grid_line.strip().split()
-                    grid.append(cells)
-                i += 1
-            problem['grid'] = grid
-            break  # No more lines after grid
-        i += 1
+def encode_table(rows):
+    """Encode a list of lists of tokens as {'tokens', 'codes'}.
+
+    tokens lists the distinct tokens and codes is a rows x cols int32 array
+    of indices into it, so every distinct token is stored only once.
+    """
+    table = new_table()
+    for row in rows:
+        add_row(table, row)
+    return build_table(table)
+
+def decode_table(table):
+    tokens = table['tokens']
+    return [[tokens[code] for code in row] for row in table['codes'].tolist()]
+
+def is_encoded(table):
+    return isinstance(table, dict)
+
+def read_grid_mdp_problem_p1(file_path):
+    problem = read_grid_mdp_problem(file_path)
+    # Build the problem object
+    return {
+        'seed': problem.get('seed'),
+        'noise': problem.get('noise'),
+        'livingReward': problem.get('livingReward'),
+        'grid': problem.get('grid', []),
+        'policy': problem.get('policy', []),
+    }
+
+def read_grid_mdp_problem_p2(file_path):
+    problem = read_grid_mdp_problem(file_path)
+    problem.setdefault('grid', [])
+    problem.setdefault('policy', [])
     return problem
 
+def read_grid_mdp_problem_p3(file_path):
+    return read_grid_mdp_problem(file_path)
@@ -0,0 +1,100 @@
+import sys, cache
+import numpy as np
+import mdp, p3
+
+# Policy backups per evaluation unless exact evaluation (which needs scipy,
+# see mdp.import_sparse) is asked for
+EVALUATION_STEPS = 20
+
+def policy_iteration(problem, evaluation=EVALUATION_STEPS, tolerance=1e-8, max_rounds=1000):
+    # Extract parameters from problem
+    grid = problem['grid']
+    discount = problem['discount']
+    noise = problem['noise']
+    livingReward = problem['livingReward']
+
+    # Compile the grid into a transition table once
+    model = mdp.compile_model(grid, noise, livingReward, problem.get('layout'))
+
+    return_value = ''
+    i, stable, backups = 0, False, 0
+    for i, V, best, stable, backups in policy_iteration_rounds(model, discount, evaluation, tolerance, max_rounds):
+        policy = p3.greedy_policy(model, best)
+
+        # Format and append the outputs
+        return_value += f"V^pi_i={i}\n"
+        return_value += p3.format_values(V, model) + '\n'
+        return_value += f"pi_i={i+1}\n"
+        return_value += p3.format_policy(policy, model) + '\n'
+
+    # Exact evaluation solves instead of backing up, so its backups are
+    # those of the improvements only
+    if evaluation == 'exact':
+        work = f"{backups} improvement backups, {i} exact solves"
+    else:
+        work = f"{backups} backups"
+    if stable:
+        return_value += f"Policy stable after {i} improvement rounds, {work}\n"
+    else:
+        return_value += f"Policy not stable after {i} improvement rounds, {work}\n"
+    return return_value.strip()
+
+def policy_iteration_rounds(model, discount, evaluation=EVALUATION_STEPS, tolerance=1e-8, max_rounds=1000):
+    """Alternate policy evaluation and greedy improvement.
+
+    evaluation is either a number of synchronous policy backups k,
+    warm-started from the previous V (modified policy iteration), or
+    'exact', a sparse linear solve of V^pi with the optional scipy (policy
+    iteration). Starts from the greedy policy for V = 0 and yields (i, V,
+    best, stable, backups) after the i-th improvement, with best the
+    improved actions as indices into p3.ACTIONS and backups the total
+    number of state backups, improvement included. Exact evaluation does
+    no backups, so backups then only counts the improvements; each round
+    also makes one solve. Stops once the policy is stable; with k-step
+    evaluation V must also be within tolerance of its backup, since a
+    stable policy alone does not mean the truncated V has converged.
+    """
+    action_codes = np.array(p3.ACTION_CODES)
+    terminal = model['terminal']
+    num_states = len(model['cells'])
+
+    V = np.zeros(num_states)
+    best = p3.greedy_actions(model, V, discount)
+    backups = num_states
+    for i in range(1, max_rounds + 1):
+        # Evaluate the current policy
+        codes = action_codes[best]
+        codes[terminal] = -1
+        if evaluation == 'exact':
+            V = mdp.solve_policy(model, discount, codes)
+        else:
+            for _ in range(evaluation):
+                V = mdp.policy_backup(model, V, discount, codes)
+            backups += evaluation * int(np.count_nonzero(codes >= 0))
+
+        # Improve it greedily, keeping the current action on ties so the
+        # loop cannot cycle between equally good policies
+        Q = mdp.q_values(model, V, discount)[:, action_codes]
+        new_best = np.argmax(Q, axis=1)
+        states = np.arange(num_states)
+        keep = Q[states, best] == Q[states, new_best]
+        new_best[keep] = best[keep]
+        backups += num_states
+
+        stable = bool(np.all(new_best == best))
+        if stable and evaluation != 'exact':
+            V_backup = Q[states, new_best]
+            V_backup[terminal] = model['terminal_rewards'][terminal]
+            stable = mdp.max_residual(V_backup, V) < tolerance
+        best = new_best
+        yield i, V, best, stable, backups
+        if stable:
+            return
+
+if __name__ == "__main__":
+    # python policy_iteration.py <problem file> [k | exact]
+    problem = cache.load_problem(sys.argv[1])
+    evaluation = sys.argv[2] if len(sys.argv) > 2 else EVALUATION_STEPS
+    if evaluation != 'exact':
+        evaluation = int(evaluation)
+    print(policy_iteration(problem, evaluation))
@@ -0,0 +1,175 @@
+import argparse, difflib, json, os, sys, tempfile, time, tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import batch, cache, mdp, parallel, parse, p1, p2, p3
+
+# Solver and parser of every problem, as passed to grader.grade by the
+# __main__ blocks of p1, p2 and p3
+PROBLEMS = {
+    1: (p1.play_episode, cache.read_grid_mdp_problem_p1),
+    2: (p2.policy_evaluation, cache.read_grid_mdp_problem_p2),
+    3: (p3.value_iteration, cache.read_grid_mdp_problem_p3),
+}
+
+def find_test_cases(problem_id):
+    path = os.path.join('test_cases', 'p' + str(problem_id))
+    ids = [int(name[:-len('.prob')]) for name in os.listdir(path)
+           if name.endswith('.prob') and name[:-len('.prob')].isdigit()]
+    return sorted(ids)
+
+def run_test_case(problem_id, test_case_id, cache_dir=None):
+    """Grade one test case like grader.check_test_case, returning the result.
+
+    The comparison is the same exact string equality; the result also holds
+    the wall time and the peak memory traced by tracemalloc while parsing
+    and solving, and the diff against the solution when the case failed.
+    Problems are read through the cache, in cache_dir if given, as the
+    graded entry points do; a cold cache entry is written while timed.
+    """
+    student_code_problem, student_code_parse = PROBLEMS[problem_id]
+    path = os.path.join('test_cases', 'p' + str(problem_id))
+    with open(os.path.join(path, str(test_case_id) + '.sol')) as file_sol:
+        solution = file_sol.read()
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        problem = student_code_parse(os.path.join(path, str(test_case_id) + '.prob'), cache_dir)
+        student_solution = student_code_problem(problem)
+        error = None
+    except Exception as e:
+        student_solution = None
+        error = '{}: {}'.format(type(e).__name__, e)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    passed = solution == student_solution
+    result = {
+        'problem': problem_id,
+        'test_case': test_case_id,
+        'check': 'grade',
+        'passed': passed,
+        'time': elapsed,
+        'peak_memory': peak,
+    }
+    if error is not None:
+        result['error'] = error
+    elif not passed:
+        result['diff'] = '\n'.join(difflib.unified_diff(
+            solution.splitlines(), student_solution.splitlines(),
+            'correct solution', 'your solution', lineterm=''))
+    return result
+
+def p3_mismatches(problem):
+    # Solvers that must reproduce the table engine's values and greedy
+    # actions exactly, bit for bit
+    model = mdp.compile_model(problem['grid'], problem['noise'], problem['livingReward'])
+    discount, iterations = problem['discount'], problem['iterations']
+    reference = list(p3.value_iteration_sweeps(model, discount, iterations))
+    mismatches = []
+    sweeps = {
+        'grid engine': list(p3.value_iteration_sweeps(model, discount, iterations, 'grid')),
+        'parallel engine': list(parallel.synchronous_sweeps(model, discount, iterations, workers=2)),
+    }
+    for name, items in sweeps.items():
+        for (k, V, best, residual, backups), item in zip(reference, items):
+            if not (np.array_equal(V, item[1]) and np.array_equal(best, item[2]) and residual == item[3]):
+                mismatches.append('{} differs at k={}'.format(name, k))
+                break
+    params = {key: problem[key] for key in batch.PARAMS}
+    result = batch.value_iteration_batch(problem['grid'], [params], iterations)
+    if reference and not (np.array_equal(result['V'][0], reference[-1][1])
+                          and np.array_equal(result['best'][0], reference[-1][2])):
+        mismatches.append('batch.value_iteration_batch differs')
+    return mismatches
+
+def p2_mismatches(problem):
+    # Evaluating the policy within a population, next to a copy of it with
+    # the moves of every non-terminal reversed, must reproduce policy_evaluation
+    model = mdp.compile_model(problem['grid'], problem['noise'], problem['livingReward'])
+    codes = mdp.compile_policy(model, problem['policy'])
+    discount, iterations = problem['discount'], problem['iterations']
+    *_, (k, V, residual) = p2.policy_evaluation_sweeps(model, discount, codes, iterations)
+    opposite = {'N': 'S', 'S': 'N', 'E': 'W', 'W': 'E'}
+    reversed_policy = [[opposite.get(token, token) for token in row] for row in problem['policy']]
+    mismatches = []
+    for workers in [None, 2]:
+        result = p2.policy_evaluation_population(problem['grid'], [problem['policy'], reversed_policy], discount,
+                                                 problem['noise'], problem['livingReward'], iterations, workers=workers)
+        if not (np.array_equal(result['V'][0], V) and result['iterations'][0] == k):
+            mismatches.append('p2.policy_evaluation_population (workers={}) differs'.format(workers))
+    return mismatches
+
+# Bit-identity checks of the alternative solvers of a problem
+EQUIVALENCE_CHECKS = {
+    2: p2_mismatches,
+    3: p3_mismatches,
+}
+
+def run_equivalence_case(problem_id, test_case_id):
+    # Same result fields as run_test_case, the mismatches in place of a diff
+    path = os.path.join('test_cases', 'p' + str(problem_id), str(test_case_id) + '.prob')
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        mismatches = EQUIVALENCE_CHECKS[problem_id](parse.read_grid_mdp_problem(path))
+    except Exception as e:
+        mismatches = ['{}: {}'.format(type(e).__name__, e)]
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    result = {
+        'problem': problem_id,
+        'test_case': test_case_id,
+        'check': 'equal',
+        'passed': not mismatches,
+        'time': elapsed,
+        'peak_memory': peak,
+    }
+    if mismatches:
+        result['diff'] = '\n'.join(mismatches)
+    return result
+
+def run_test_cases(problem_ids, workers=None):
+    # Cache entries go to a fresh temporary directory, so every run starts
+    # cold and leaves nothing next to the test cases
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cases = [(run_test_case, problem_id, test_case_id, cache_dir) for problem_id in problem_ids
+                 for test_case_id in find_test_cases(problem_id)]
+        cases += [(run_equivalence_case, problem_id, test_case_id) for problem_id in problem_ids
+                  if problem_id in EQUIVALENCE_CHECKS for test_case_id in find_test_cases(problem_id)]
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(*case) for case in cases]
+            return [future.result() for future in futures]
+
+def format_report(results):
+    lines = ['problem  case  check  status   time (ms)  peak (KiB)']
+    for result in results:
+        lines.append('{:>7}  {:>4}  {:<5}  {:<6}  {:>10.2f}  {:>10.1f}'.format(
+            result['problem'], result['test_case'], result['check'],
+            'PASSED' if result['passed'] else 'FAILED',
+            result['time'] * 1000, result['peak_memory'] / 1024))
+    passed = sum(result['passed'] for result in results)
+    total_time = sum(result['time'] for result in results)
+    lines.append('{}/{} passed, {:.2f} ms total solver time'.format(passed, len(results), total_time * 1000))
+    for result in results:
+        if not result['passed']:
+            lines.append('---------- Problem {} test case {} ({}) ----------'.format(
+                result['problem'], result['test_case'], result['check']))
+            lines.append(result.get('error') or result['diff'])
+    return '\n'.join(lines)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Run test cases across a process pool.')
+    parser.add_argument('problems', nargs='*', type=int, default=sorted(PROBLEMS))
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args()
+
+    results = run_test_cases(args.problems, args.workers)
+    print(format_report(results))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    sys.exit(0 if all(result['passed'] for result in results) else 1)
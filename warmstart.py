@@ -0,0 +1,115 @@
+import collections, hashlib, json, os, tempfile, time, zipfile
+import numpy as np
+import cache as problem_cache
+
+# Parameters whose distance decides which cached values warm-start a solve
+PARAMS = ['discount', 'noise', 'livingReward']
+
+def make_value_cache(capacity=64, directory=None, max_distance=0.1):
+    """Bounded LRU cache of solved value arrays, for warm starts.
+
+    Entries are keyed by the fingerprint of the grid (and policy, for policy
+    evaluation) and the PARAMS of the solve. A lookup returns the values of
+    the entry of the same fingerprint whose parameters are nearest, within
+    max_distance (Euclidean). With a directory, entries are also kept there
+    as .npz files, so they survive between processes; the least recently
+    used entries are evicted from both once there are more than capacity.
+    Unreadable files, such as those left by a crashed writer, are removed.
+    """
+    cache = {
+        'entries': collections.OrderedDict(),
+        'capacity': capacity,
+        'directory': directory,
+        'max_distance': max_distance,
+    }
+    if directory is not None:
+        os.makedirs(directory, exist_ok=True)
+        now = time.time()
+        mtimes = {}
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            try:
+                mtime = os.path.getmtime(path)
+            except OSError:
+                continue  # Evicted by another process meanwhile
+            if name.endswith('.npz'):
+                mtimes[path] = mtime
+            elif name.startswith(problem_cache.TMP_PREFIX) and now - mtime > problem_cache.TMP_MAX_AGE:
+                remove(path)
+        # Oldest first, lookups refresh the mtime of the entries they use
+        for path in sorted(mtimes, key=mtimes.get):
+            try:
+                with np.load(path) as data:
+                    params = json.loads(str(data['params']))
+                    key = (str(data['fingerprint']),) + tuple(params[name] for name in PARAMS)
+                    cache['entries'][key] = data['V']
+            except (OSError, ValueError, KeyError, EOFError, zipfile.BadZipFile):
+                remove(path)
+        evict(cache)
+    return cache
+
+def fingerprint(model, codes=None):
+    # Hash of the compiled grid layout, and of the policy codes if given
+    digest = hashlib.sha256()
+    digest.update(np.array([model['rows'], model['cols']], dtype=np.int64).tobytes())
+    for name in ['index', 'terminal', 'terminal_rewards', 'neighbours']:
+        digest.update(np.ascontiguousarray(model[name]).tobytes())
+    if codes is not None:
+        digest.update(np.ascontiguousarray(codes, dtype=np.int64).tobytes())
+    return digest.hexdigest()
+
+def lookup_values(cache, key, params):
+    """Values of the nearest cached solve for the same fingerprint, or None."""
+    target = np.array([params[name] for name in PARAMS], dtype=float)
+    nearest, nearest_distance = None, cache['max_distance']
+    for entry in cache['entries']:
+        if entry[0] != key:
+            continue
+        distance = float(np.linalg.norm(np.array(entry[1:], dtype=float) - target))
+        if distance <= nearest_distance:
+            nearest, nearest_distance = entry, distance
+    if nearest is None:
+        return None
+    cache['entries'].move_to_end(nearest)
+    if cache['directory'] is not None:
+        try:
+            os.utime(entry_path(cache, nearest))
+        except OSError:
+            pass  # Evicted by another process, the values are still in memory
+    return np.array(cache['entries'][nearest])
+
+def store_values(cache, key, params, V):
+    entry = (key,) + tuple(params[name] for name in PARAMS)
+    cache['entries'][entry] = np.array(V)
+    cache['entries'].move_to_end(entry)
+    if cache['directory'] is not None:
+        # Write to a unique temporary file and move it in place, so
+        # concurrent writers never interleave and readers never see a
+        # partial file
+        path = entry_path(cache, entry)
+        fd, tmp = tempfile.mkstemp(prefix=problem_cache.TMP_PREFIX, dir=cache['directory'])
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, V=V, fingerprint=key, params=json.dumps({name: params[name] for name in PARAMS}))
+            os.replace(tmp, path)
+        except BaseException:
+            os.remove(tmp)
+            raise
+    evict(cache)
+
+def evict(cache):
+    entries = cache['entries']
+    while len(entries) > cache['capacity']:
+        entry, _ = entries.popitem(last=False)
+        if cache['directory'] is not None:
+            remove(entry_path(cache, entry))
+
+def remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+def entry_path(cache, entry):
+    name = hashlib.sha1(json.dumps(entry).encode()).hexdigest()[:16]
+    return os.path.join(cache['directory'], entry[0][:16] + '-' + name + '.npz')